@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+# Archive des réponses HTTP pour l'enregistrement et le rejeu hors ligne
+# Le client HTTP partagé (client_http.py) peut enregistrer chaque réponse valide reçue de
+# atmo-hdf.fr, atmo-france.org, GitHub ou Nominatim dans un dossier local, puis rejouer ces
+# réponses sans aucun accès réseau (démonstrations, tests de charge) ou seulement quand
+# l'hôte ne répond plus (mode secours : contenu éventuellement ancien mais servi tout de suite).
+# Les réponses sont rangées par URL normalisée (schéma et hôte en minuscules, paramètres triés,
+# fragment retiré). Les pages des communes portent la date du jour dans leur URL : elles ne sont
+# rangées que sous la même adresse sans date, chaque enregistrement remplaçant le précédent, et le
+# rejeu sert la dernière page enregistrée (l'archive ne grossit pas d'un crawl complet par jour).
+# Le jour des derniers enregistrements est noté dans l'archive : en rejeu, c'est la date du snapshot.
+#
+# Réglages : POLLEN_ARCHIVE_MODE = enregistrer | rejouer | secours (absent : archive inactive)
+#            POLLEN_ARCHIVE = dossier de l'archive (archive_http/ par défaut)
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import metriques
+
+ENREGISTRER = 'enregistrer'
+REJOUER = 'rejouer'
+SECOURS = 'secours'
+MODES = (ENREGISTRER, REJOUER, SECOURS)
+DOSSIER = os.environ.get('POLLEN_ARCHIVE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive_http'))
+# Paramètres qui changent à chaque appel sans changer la nature de la page
+PARAMETRES_VARIABLES = {'date'}
+PORTS_PAR_DEFAUT = {'http': 80, 'https': 443}
+ENTETES_CONSERVES = ('Content-Type', 'ETag', 'Last-Modified')
+# Fichier de l'archive qui contient le jour des derniers enregistrements (AAAA-MM-JJ)
+FICHIER_JOUR = 'jour_enregistrement'
+
+
+# Erreur levée en mode rejeu quand une URL n'a jamais été enregistrée
+# (sous-classe de ConnectionError pour être traitée comme une erreur réseau ordinaire)
+class ReponseAbsente(requests.ConnectionError):
+    pass
+
+
+# Fonction pour normaliser une URL : deux écritures de la même adresse donnent la même clé
+def normaliser_url(url, ignorer=()):
+    morceaux = urlsplit(url)
+    schema = morceaux.scheme.lower()
+    hote = (morceaux.hostname or '').lower()
+    if morceaux.port and morceaux.port != PORTS_PAR_DEFAUT.get(schema):
+        hote = f"{hote}:{morceaux.port}"
+    parametres = sorted((cle, valeur) for cle, valeur in parse_qsl(morceaux.query, keep_blank_values=True)
+                        if cle not in ignorer)
+    return urlunsplit((schema, hote, morceaux.path or '/', urlencode(parametres), ''))
+
+
+# Réponse lue dans l'archive, avec les attributs de requests.Response utilisés par l'application
+class ReponseArchivee:
+    def __init__(self, entree):
+        self.status_code = entree['status_code']
+        self.content = entree['content']
+        self.headers = CaseInsensitiveDict(entree['headers'])
+        self.encoding = entree['encoding']
+        self.url = entree['url']
+        self.enregistree_a = entree['enregistre_a']
+        self.source = 'archive'
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} pour l'URL {self.url}")
+
+
+class ArchiveHTTP:
+    def __init__(self, mode, dossier=DOSSIER, ignorer=PARAMETRES_VARIABLES):
+        if mode not in MODES:
+            raise ValueError(f"Mode d'archive inconnu : {mode} (attendu : {', '.join(MODES)})")
+        self.mode = mode
+        self.dossier = dossier
+        self.ignorer = frozenset(ignorer)
+        self.statistiques = {'enregistrees': 0, 'rejouees': 0, 'absentes': 0, 'secours': 0}
+        self.jour_enregistre = None
+        os.makedirs(dossier, exist_ok=True)
+
+    @property
+    def enregistre(self):
+        return self.mode in (ENREGISTRER, SECOURS)
+
+    # Clés d'une URL : l'adresse exacte, puis la même adresse sans les paramètres variables
+    def cles(self, url):
+        exacte = normaliser_url(url)
+        generique = normaliser_url(url, self.ignorer)
+        return (exacte,) if generique == exacte else (exacte, generique)
+
+    def _chemin(self, cle):
+        return os.path.join(self.dossier, hashlib.sha1(cle.encode('utf-8')).hexdigest() + '.pkl')
+
+    # Fonction pour enregistrer une réponse valide (les erreurs ne sont jamais archivées)
+    def enregistrer(self, url, response):
+        if response.status_code != 200:
+            return False
+        entree = {
+            'url': url,
+            'status_code': response.status_code,
+            'content': response.content,
+            'headers': {cle: response.headers[cle] for cle in ENTETES_CONSERVES if cle in response.headers},
+            'encoding': response.encoding,
+            'enregistre_a': time.time(),
+        }
+        # Seulement sous la dernière clé (sans les paramètres variables) : les copies datées ne seraient jamais relues
+        chemin = self._chemin(self.cles(url)[-1])
+        # Fichier temporaire propre au thread : plusieurs threads du crawl écrivent en même temps
+        suffixe = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(chemin + suffixe, 'wb') as f:
+                pickle.dump(entree, f)
+            os.replace(chemin + suffixe, chemin)
+            self._noter_jour(suffixe)
+        except OSError as e:
+            print("Impossible d'écrire dans l'archive HTTP :", e)
+            return False
+        self.statistiques['enregistrees'] += 1
+        metriques.compter('archive_http', resultat='enregistree')
+        return True
+
+    # Fonction pour noter le jour des enregistrements (réécrit seulement au changement de jour)
+    def _noter_jour(self, suffixe):
+        jour = datetime.date.today().isoformat()
+        if jour == self.jour_enregistre:
+            return
+        chemin = os.path.join(self.dossier, FICHIER_JOUR)
+        with open(chemin + suffixe, 'w', encoding='utf-8') as f:
+            f.write(jour)
+        os.replace(chemin + suffixe, chemin)
+        self.jour_enregistre = jour
+
+    # Fonction pour lire le jour des derniers enregistrements (None pour une archive qui ne l'a pas noté)
+    def jour_enregistrement(self):
+        try:
+            with open(os.path.join(self.dossier, FICHIER_JOUR), encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    # Fonction pour lire la réponse enregistrée d'une URL (None si elle n'a jamais été enregistrée)
+    def lire(self, url):
+        for cle in self.cles(url):
+            try:
+                with open(self._chemin(cle), 'rb') as f:
+                    return ReponseArchivee(pickle.load(f))
+            except FileNotFoundError:
+                continue
+            except (OSError, pickle.PickleError, EOFError) as e:
+                print("Entrée illisible dans l'archive HTTP :", e)
+        return None
+
+    # Fonction pour servir une URL depuis l'archive seule (mode rejeu)
+    def rejouer(self, url):
+        response = self.lire(url)
+        if response is None:
+            self.statistiques['absentes'] += 1
+            metriques.compter('archive_http', resultat='absente')
+            raise ReponseAbsente(f"Réponse absente de l'archive : {url}")
+        self.statistiques['rejouees'] += 1
+        metriques.compter('archive_http', resultat='rejouee')
+        return response
+
+    # Fonction pour servir une URL depuis l'archive quand l'hôte est en panne (mode secours)
+    def secourir(self, url):
+        response = self.lire(url)
+        if response is not None:
+            self.statistiques['secours'] += 1
+            metriques.compter('archive_http', resultat='secours')
+        return response
+
+
+# Fonction pour créer l'archive décrite par les variables d'environnement (None si elle est inactive)
+def depuis_environnement():
+    mode = os.environ.get('POLLEN_ARCHIVE_MODE')
+    if not mode:
+        return None
+    return ArchiveHTTP(mode)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# Article « Surveillance des pollens » d'atmo-hdf.fr, rafraîchi une seule fois pour tous
+# Un thread de fond télécharge et analyse l'article à intervalle régulier : les paragraphes
+# d'information (onglet « Informations sur le Pollen ») et l'adresse de la vidéo (onglet
+# « La mesure des pollens ») sont gardés en mémoire avec un numéro de version, l'empreinte
+# du contenu extrait. Les navigateurs ouverts ne font que comparer leur version à celle du
+# serveur : le contenu n'est renvoyé que s'il a changé, quel que soit le nombre de clients.
+import hashlib
+import threading
+import time
+
+import requests
+from bs4 import BeautifulSoup
+
+import metriques
+from cache_http import cache
+
+URL = "https://www.atmo-hdf.fr/article/surveillance-des-pollens"
+INTERVALLE_RAFRAICHISSEMENT = 3600
+# Nouvel essai plus rapproché tant que l'article n'a jamais pu être lu
+INTERVALLE_ECHEC = 300
+
+
+class ArticleSurveillance:
+    def __init__(self, url=URL, intervalle=INTERVALLE_RAFRAICHISSEMENT):
+        self.url = url
+        self.intervalle = intervalle
+        self.version = None
+        self.paragraphes = []
+        self.url_video = None
+        # Message à afficher tant qu'aucune version de l'article n'a pu être lue
+        self.erreur = "L'article n'a pas encore été chargé."
+        self.verrou = threading.Lock()
+        self.thread = None
+
+    # Fonction pour télécharger et analyser l'article ; renvoie True si son contenu a changé
+    def rafraichir(self):
+        try:
+            response = cache.get(self.url)
+        except requests.RequestException as e:
+            return self._echec("La page de l'article est indisponible : {}".format(e))
+        if response.status_code != 200:
+            return self._echec("La requête a échoué avec le code de statut: {}".format(response.status_code))
+        with metriques.mesurer('analyse_html', page='surveillance'):
+            soup = BeautifulSoup(response.text, "html.parser")
+        div_field_item = soup.find("div", class_="field__item")
+        paragraphes = [p.text for p in div_field_item.find_all("p")] if div_field_item else []
+        iframe_tag = soup.find("iframe", src=True)
+        url_video = iframe_tag["src"] if iframe_tag else None
+        version = hashlib.sha1(repr((paragraphes, url_video)).encode('utf-8')).hexdigest()[:12]
+        with self.verrou:
+            if version == self.version:
+                return False
+            self.version = version
+            self.paragraphes = paragraphes
+            self.url_video = url_video
+            self.erreur = None
+        metriques.compter('article_surveillance', resultat='nouvelle_version')
+        return True
+
+    # En cas d'échec, la dernière version lue reste servie
+    def _echec(self, message):
+        print("Échec du rafraîchissement de l'article surveillance des pollens :", message)
+        with self.verrou:
+            if self.version is None:
+                self.erreur = message
+        return False
+
+    # Fonction pour lire l'état courant : (version, paragraphes, adresse de la vidéo, message d'erreur)
+    def obtenir(self):
+        with self.verrou:
+            return self.version, self.paragraphes, self.url_video, self.erreur
+
+    def _boucle(self):
+        while True:
+            try:
+                self.rafraichir()
+            except Exception as e:
+                print("Échec du rafraîchissement de l'article surveillance des pollens :", e)
+            time.sleep(self.intervalle if self.version is not None else INTERVALLE_ECHEC)
+
+    # Fonction pour lancer le rafraîchissement périodique en tâche de fond
+    def demarrer(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._boucle, name='article-surveillance', daemon=True)
+            self.thread.start()
+        return self
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Mesure du coût d'analyse d'une page pollen atmo-hdf.fr
+# Compare l'ancienne extraction (arbre BeautifulSoup complet construit deux fois : une fois
+# pour les taxons, une fois pour la couleur de l'indice) à analyser_page, qui ne construit
+# que les balises utiles en une seule analyse. Les pages sont lues dans le dossier
+# pages_exemple/ ; s'il est vide, quelques pages sont d'abord téléchargées et enregistrées.
+#
+# Utilisation : python bench_analyse.py [dossier] [repetitions]
+import datetime
+import glob
+import os
+import sys
+import time
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+from cache_http import cache
+from snapshot_pollen import analyser_page, construire_url
+
+DOSSIER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages_exemple')
+COMMUNES_EXEMPLE = ['80021', '59350', '62041', '60057', '02691']
+REPETITIONS = 20
+
+
+# Ancienne extraction, reprise telle quelle de update_output et color_ville
+def analyser_page_avant(html_page):
+    soup = BeautifulSoup(html_page, 'html.parser')
+    balises_pollens = soup.find_all('p', class_='c-indice-pollen-taxon-title font-weight-bold text-center')
+    balises_categories = soup.find_all('p', class_='text-uppercase mt-2')
+    balise_departement = soup.find('p', class_='font-weight-bold text-uppercase mt-3')
+    taxons = [(p.get_text(strip=True), c.get_text(strip=True)) for p, c in zip(balises_pollens, balises_categories)]
+
+    soup = BeautifulSoup(html_page, 'html.parser')
+    couleur = None
+    indice = None
+    pollen_value_span = soup.find('span', class_='pollen-value')
+    if pollen_value_span:
+        parent_div = pollen_value_span.find_parent('div', class_='c-indice-pollen')
+        if parent_div:
+            path_fill = parent_div.find('path')
+            if path_fill:
+                couleur = path_fill['fill']
+                indice = int(pollen_value_span.get_text(strip=True))
+    return taxons, balise_departement.get_text(strip=True) if balise_departement else None, indice, couleur
+
+
+# Fonction pour enregistrer quelques pages communes dans le dossier d'exemples
+def enregistrer_pages(dossier):
+    os.makedirs(dossier, exist_ok=True)
+    data = pd.read_csv("villes_hauts_de_france_modifie.csv", dtype={'code_postal': str, 'code_commune_INSEE': str})
+    date = datetime.date.today().isoformat()
+    for commune in data[data['code_commune_INSEE'].isin(COMMUNES_EXEMPLE)].itertuples(index=False):
+        url = construire_url(commune.nom_commune_postal, commune.code_commune_INSEE, commune.code_postal, date)
+        response = cache.get(url)
+        if response.status_code == 200:
+            with open(os.path.join(dossier, commune.code_commune_INSEE + '.html'), 'w', encoding='utf-8') as f:
+                f.write(response.text)
+
+
+def mesurer(fonction, pages, repetitions):
+    debut = time.perf_counter()
+    for _ in range(repetitions):
+        for page in pages:
+            fonction(page)
+    return (time.perf_counter() - debut) / (repetitions * len(pages))
+
+
+def main(dossier=DOSSIER, repetitions=REPETITIONS):
+    if not glob.glob(os.path.join(dossier, '*.html')):
+        enregistrer_pages(dossier)
+    pages = []
+    for chemin in sorted(glob.glob(os.path.join(dossier, '*.html'))):
+        with open(chemin, encoding='utf-8') as f:
+            pages.append(f.read())
+    if not pages:
+        print("Aucune page d'exemple disponible dans", dossier)
+        return
+
+    # Les deux extractions doivent donner le même résultat
+    for page in pages:
+        releve = analyser_page(page)
+        if analyser_page_avant(page) != (releve.taxons, releve.departement, releve.indice, releve.couleur):
+            print("Résultats différents entre les deux extractions")
+
+    avant = mesurer(analyser_page_avant, pages, repetitions)
+    apres = mesurer(analyser_page, pages, repetitions)
+    print(f"{len(pages)} pages, {repetitions} répétitions")
+    print(f"Avant : {avant * 1000:.2f} ms par page")
+    print(f"Après : {apres * 1000:.2f} ms par page ({avant / apres:.1f}x plus rapide)")
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    main(arguments[0] if arguments else DOSSIER, int(arguments[1]) if len(arguments) > 1 else REPETITIONS)
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+# Banc de mesure et test de charge des callbacks du tableau de bord
+# Tous les appels sortants de l'application sont redirigés vers un serveur bouchon local
+# qui rejoue les pages enregistrées dans pages_exemple/ (voir bench_analyse.py) ou, à défaut,
+# des pages atmo-hdf.fr générées, ainsi que des contours de communes fictifs : aucune
+# connexion réseau n'est nécessaire. Le banc appelle d'abord les callbacks directement,
+# puis à travers HTTP avec plusieurs clients simultanés, et affiche les latences
+# p50/p95/p99, le débit et la mémoire occupée par le worker. Tous les fichiers écrits par
+# l'application (historique, caches, contours fictifs et géométries simplifiées) vont dans un
+# dossier temporaire. Le banc échoue (code de sortie 1) si une requête échoue.
+#
+# Utilisation : python bench_tableau_de_bord.py [requetes] [concurrence]
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+import client_http
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+DOSSIER = os.path.dirname(os.path.abspath(__file__))
+DOSSIER_PAGES = os.path.join(DOSSIER, 'pages_exemple')
+FICHIER_VILLES = os.path.join(DOSSIER, 'villes_hauts_de_france_modifie.csv')
+REQUETES = 200
+CONCURRENCE = 8
+TAXONS = ['Ambroisie', 'Armoise', 'Aulne', 'Bouleau', 'Graminées', 'Olivier']
+CATEGORIES = ['Nul', 'Faible', 'Moyen', 'Élevé']
+COULEURS = ['#50F0E6', '#50CCAA', '#F0E641', '#FF5050', '#960032', '#872181']
+
+
+# Fonction pour produire une page commune au format atmo-hdf.fr (déterministe pour un code INSEE)
+def page_commune(code_insee):
+    aleatoire = random.Random(code_insee)
+    indice = aleatoire.randint(1, 6)
+    blocs = ''.join(
+        f'<div><p class="c-indice-pollen-taxon-title font-weight-bold text-center">{taxon}</p>'
+        f'<p class="text-uppercase mt-2">{aleatoire.choice(CATEGORIES)}</p></div>'
+        for taxon in TAXONS)
+    return (
+        '<html><head>' + '<script>var a = 1;</script>' * 50 + '</head><body>'
+        + '<nav><ul>' + '<li><a href="#">Lien</a></li>' * 300 + '</ul></nav>'
+        + f'<div class="c-indice-pollen"><svg><path fill="{COULEURS[indice - 1]}" d="M0 0"/></svg>'
+        + f'<span class="pollen-value">{indice}</span></div>'
+        + f'<p class="font-weight-bold text-uppercase mt-3">{aleatoire.choice(CATEGORIES)}</p>'
+        + blocs + '<footer>' + '<p>Texte</p>' * 200 + '</footer></body></html>'
+    )
+
+
+# Fonction pour produire l'article de surveillance des pollens (paragraphes et vidéo)
+def page_article():
+    paragraphes = ''.join(f'<p>Paragraphe {i} sur la surveillance des pollens.</p>' for i in range(5))
+    return (f'<html><body><div class="field__item">{paragraphes}</div>'
+            '<h2 id="item-4755">Recommandations</h2><ul><li>Aérer le matin</li><li>Se rincer les cheveux</li></ul>'
+            '<iframe src="https://www.youtube.com/embed/exemple"></iframe></body></html>')
+
+
+# Fonction pour produire des contours fictifs : un carré d'environ 2 km autour de chaque commune
+def geojson_communes():
+    data = pd.read_csv(FICHIER_VILLES, dtype={'code_commune_INSEE': str}).drop_duplicates('code_commune_INSEE')
+    features = []
+    for commune in data.itertuples(index=False):
+        x, y, d = float(commune.longitude), float(commune.latitude), 0.01
+        features.append({
+            'type': 'Feature',
+            'properties': {'code': commune.code_commune_INSEE, 'nom': commune.nom_commune_postal},
+            'geometry': {'type': 'Polygon', 'coordinates': [[[x - d, y - d], [x + d, y - d], [x + d, y + d], [x - d, y + d], [x - d, y - d]]]},
+        })
+    return json.dumps({'type': 'FeatureCollection', 'features': features}).encode('utf-8')
+
+
+# Serveur bouchon : répond selon le chemin de l'URL d'origine, quel que soit l'hôte
+class ServeurBouchon:
+    def __init__(self):
+        self.pages_enregistrees = {}
+        for chemin in glob.glob(os.path.join(DOSSIER_PAGES, '*.html')):
+            with open(chemin, encoding='utf-8') as f:
+                self.pages_enregistrees[os.path.basename(chemin)[:-5]] = f.read()
+        self.geojson = geojson_communes()
+        with open(FICHIER_VILLES, 'rb') as f:
+            self.villes = f.read()
+        self.requetes = 0
+        bouchon = self
+
+        class Gestionnaire(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                bouchon.requetes += 1
+                statut, type_contenu, contenu = bouchon.repondre(self.path)
+                self.send_response(statut)
+                self.send_header('Content-Type', type_contenu)
+                self.send_header('Content-Length', str(len(contenu)))
+                self.end_headers()
+                self.wfile.write(contenu)
+
+            def log_message(self, *args):
+                pass
+
+        self.serveur = ThreadingHTTPServer(('127.0.0.1', 0), Gestionnaire)
+        self.serveur.daemon_threads = True
+        self.adresse = f'http://127.0.0.1:{self.serveur.server_port}'
+
+    def repondre(self, chemin):
+        chemin = urlsplit(chemin).path
+        if chemin.startswith('/air-commune/'):
+            code_insee = chemin.split('/')[3]
+            page = self.pages_enregistrees.get(code_insee) or page_commune(code_insee)
+            return 200, 'text/html; charset=utf-8', page.encode('utf-8')
+        if chemin.startswith('/article/'):
+            return 200, 'text/html; charset=utf-8', page_article().encode('utf-8')
+        if chemin.endswith('communes-hauts-de-france.geojson'):
+            return 200, 'application/json', self.geojson
+        if chemin.startswith('/uc'):
+            return 200, 'text/csv', self.villes
+        return 404, 'text/plain', b'introuvable'
+
+    def demarrer(self):
+        threading.Thread(target=self.serveur.serve_forever, name='serveur-bouchon', daemon=True).start()
+        return self
+
+
+# Adaptateur requests qui envoie toutes les requêtes vers le serveur bouchon
+class AdaptateurBouchon(HTTPAdapter):
+    def __init__(self, adresse):
+        super().__init__()
+        self.adresse = adresse
+
+    def send(self, request, **kwargs):
+        morceaux = urlsplit(request.url)
+        request.url = self.adresse + morceaux.path + ('?' + morceaux.query if morceaux.query else '')
+        return super().send(request, **kwargs)
+
+
+# Fonction pour lire la mémoire résidente du processus (en Mo)
+def memoire_mo():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(valeurs, p):
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))]
+
+
+def afficher(nom, durees, total=None):
+    ligne = (f"{nom:<32} n={len(durees):<5} p50={percentile(durees, 50) * 1000:8.2f} ms  "
+             f"p95={percentile(durees, 95) * 1000:8.2f} ms  p99={percentile(durees, 99) * 1000:8.2f} ms")
+    if total:
+        ligne += f"  {len(durees) / total:8.1f} req/s"
+    print(ligne)
+
+
+def chronometrer(fonction, *arguments):
+    debut = time.perf_counter()
+    resultat = fonction(*arguments)
+    return time.perf_counter() - debut, resultat
+
+
+# Mesure des callbacks appelés directement, sans passer par Flask
+def mesurer_direct(app_module, codes, requetes):
+    mesures = {'charger_commune': [], 'recuperation a la volee': [], 'update_output': [], 'update_map_src': [],
+               'render_content': []}
+    onglets = ['tab-1', 'tab-2', 'tab-3', 'tab-4', 'tab-5', 'tab-6']
+    for i in range(requetes):
+        code = random.choice(codes)
+        duree, (donnees, termine) = chronometrer(app_module.charger_commune, code, None)
+        mesures['charger_commune'].append(duree)
+        if not termine:
+            # Commune pas encore crawlée : le callback a lancé sa récupération sans l'attendre
+            commune = app_module.index.resoudre(code)[0]
+            debut = time.perf_counter()
+            app_module.snapshot.recuperer_en_fond(commune.nom, commune.code_insee, commune.code_postal).result()
+            mesures['recuperation a la volee'].append(time.perf_counter() - debut)
+            donnees, _ = app_module.charger_commune(code, None, donnees)
+        mesures['update_output'].append(chronometrer(app_module.update_output, donnees)[0])
+        mesures['update_map_src'].append(chronometrer(app_module.update_map_src, donnees)[0])
+        mesures['render_content'].append(chronometrer(app_module.render_content, onglets[i % len(onglets)])[0])
+    print("Callbacks appelés directement")
+    for nom, durees in mesures.items():
+        if durees:
+            afficher(nom, durees)
+
+
+# Corps d'une requête /_dash-update-component
+# (sortie : 'id.propriete', ou liste de sorties pour un callback à plusieurs sorties ; entree : 'id.propriete'
+# avec sa valeur, ou liste de ('id.propriete', valeur) dans l'ordre du callback avec declencheur, l'entrée modifiée ;
+# etats : liste de ('id.propriete', valeur) des State du callback)
+def corps_callback(sortie, entree, valeur=None, declencheur=None, etats=()):
+    entrees = entree if isinstance(entree, list) else [(entree, valeur)]
+    if isinstance(sortie, list):
+        sorties = [dict(zip(('id', 'property'), s.split('.'))) for s in sortie]
+        sortie = '..' + '...'.join(sortie) + '..'
+    else:
+        sorties = dict(zip(('id', 'property'), sortie.split('.')))
+    return {
+        'output': sortie,
+        'outputs': sorties,
+        'inputs': [dict(zip(('id', 'property'), nom.split('.')), value=v) for nom, v in entrees],
+        'changedPropIds': [declencheur or entrees[0][0]],
+        'state': [dict(zip(('id', 'property'), nom.split('.')), value=v) for nom, v in etats],
+    }
+
+
+# Fonction pour appeler un callback par HTTP
+def appeler(session, adresse, corps):
+    response = session.post(adresse + '/_dash-update-component', json=corps)
+    response.raise_for_status()
+    return response
+
+
+# Fonction pour charger une commune par HTTP comme le navigateur : tant que le callback renvoie un
+# marqueur de chargement, l'intervalle 'attente-commune' le rappelle (renvoie les données et la durée
+# de la première réponse, celle pendant laquelle un thread du serveur est occupé)
+def charger_commune_http(session, adresse, code, intervalle):
+    sorties = ['donnees-commune.data', 'attente-commune.disabled']
+    debut = time.perf_counter()
+    reponse = appeler(session, adresse, corps_callback(sorties, [('input-ville.value', code), ('attente-commune.n_intervals', None)],
+                                                       etats=[('donnees-commune.data', None)]))
+    premiere_reponse = time.perf_counter() - debut
+    resultat = reponse.json()['response']
+    donnees = resultat['donnees-commune']['data']
+    n_intervals = 0
+    while not resultat['attente-commune']['disabled']:
+        time.sleep(intervalle)
+        n_intervals += 1
+        reponse = appeler(session, adresse, corps_callback(
+            sorties, [('input-ville.value', code), ('attente-commune.n_intervals', n_intervals)],
+            declencheur='attente-commune.n_intervals', etats=[('donnees-commune.data', donnees)]))
+        resultat = reponse.json()['response']
+        donnees = resultat.get('donnees-commune', {}).get('data', donnees)
+    return donnees, premiere_reponse
+
+
+# Test de charge à travers HTTP : chaque client simule une sélection de commune complète
+def mesurer_http(app_module, codes, requetes, concurrence):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class GestionnaireSilencieux(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    serveur = make_server('127.0.0.1', 0, app_module.app.server, threaded=True, request_handler=GestionnaireSilencieux)
+    threading.Thread(target=serveur.serve_forever, name='serveur-dash', daemon=True).start()
+    adresse = f'http://127.0.0.1:{serveur.server_port}'
+    sessions = threading.local()
+    mesures = {'charger_commune (1re reponse)': [], 'selection (3 callbacks)': [], 'changement d\'onglet': []}
+    intervalle = app_module.INTERVALLE_ATTENTE_COMMUNE / 1000
+    erreurs = []
+
+    def selection(i):
+        session = getattr(sessions, 'session', None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        code = random.choice(codes)
+        try:
+            debut = time.perf_counter()
+            donnees, premiere_reponse = charger_commune_http(session, adresse, code, intervalle)
+            mesures['charger_commune (1re reponse)'].append(premiere_reponse)
+            appeler(session, adresse, corps_callback('output-container.children', 'donnees-commune.data', donnees))
+            appeler(session, adresse, corps_callback(['map-iframe.src', 'map-iframe.srcDoc'], 'donnees-commune.data', donnees))
+            mesures['selection (3 callbacks)'].append(time.perf_counter() - debut)
+            debut = time.perf_counter()
+            appeler(session, adresse, corps_callback('tabs-content.children', 'tabs.value', 'tab-2'))
+            mesures['changement d\'onglet'].append(time.perf_counter() - debut)
+        except (requests.RequestException, KeyError, ValueError) as e:
+            erreurs.append(e)
+
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrence) as executor:
+        list(executor.map(selection, range(requetes)))
+    total = time.perf_counter() - debut
+    serveur.shutdown()
+    print(f"Test de charge HTTP ({concurrence} clients simultanés, {requetes} sélections en {total:.1f} s)")
+    for nom, durees in mesures.items():
+        if durees:
+            afficher(nom, durees, total)
+    if erreurs:
+        print(f"ÉCHEC : {len(erreurs)} erreurs, par exemple : {erreurs[0]}")
+    return not erreurs
+
+
+def main(requetes=REQUETES, concurrence=CONCURRENCE):
+    bouchon = ServeurBouchon().demarrer()
+    # Tous les appels sortants passent par le client partagé : on le branche sur le bouchon
+    adaptateur = AdaptateurBouchon(bouchon.adresse)
+    client_http.client.session.mount('https://', adaptateur)
+    client_http.client.session.mount('http://', adaptateur)
+    # Fichiers de travail de l'application dans un dossier temporaire : les contours fictifs du bouchon
+    # ne doivent jamais remplacer ceux de l'application (téléchargés seulement s'ils sont absents)
+    dossier = tempfile.mkdtemp(prefix='bench-pollens-')
+    for variable, nom in (('POLLEN_HISTORIQUE', 'historique.sqlite'), ('POLLEN_CACHE_DEMARRAGE', 'demarrage'),
+                          ('POLLEN_PARTAGE', 'partage'), ('POLLEN_CONTOURS', 'communes-hauts-de-france.geojson'),
+                          ('POLLEN_GEOMETRIES', 'geometries')):
+        os.environ.setdefault(variable, os.path.join(dossier, nom))
+
+    memoire_depart = memoire_mo()
+    debut = time.perf_counter()
+    import exemples as app_module
+    print(f"Import de l'application : {time.perf_counter() - debut:.2f} s")
+    codes = list(app_module.index.par_insee)
+    # Les contours sont chargés en tâche de fond au démarrage : on attend qu'ils soient prêts
+    import contours_communes
+    contours_communes.attendre()
+
+    mesurer_direct(app_module, codes, requetes)
+    reussi = mesurer_http(app_module, codes, requetes, concurrence)
+    memoire_fin = memoire_mo()
+    print(f"Mémoire du worker : {memoire_depart:.0f} Mo au départ, {memoire_fin:.0f} Mo à la fin "
+          f"({memoire_fin - memoire_depart:+.0f} Mo)")
+    print(f"Requêtes reçues par le serveur bouchon : {bouchon.requetes}")
+    print(f"Cache des cartes : {app_module.cache_cartes.statistiques}")
+    return reussi
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    reussi = main(int(arguments[0]) if arguments else REQUETES, int(arguments[1]) if len(arguments) > 1 else CONCURRENCE)
+    # Le crawl du snapshot lancé par l'application tourne encore : on n'attend pas sa fin
+    sys.stdout.flush()
+    os._exit(0 if reussi else 1)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+# Cache partagé des réponses HTTP
+# Toutes les pages et images récupérées sur atmo-hdf.fr, atmo-france.org, GitHub ou
+# Nominatim passent par ce cache : un LRU en mémoire limité en taille, doublé d'un
+# stockage optionnel sur disque. Chaque type d'adresse a sa propre durée de vie (TTL).
+# Une entrée expirée depuis peu est encore servie pendant qu'on la revalide en tâche
+# de fond (stale-while-revalidate), avec une requête conditionnelle ETag/Last-Modified.
+# Les téléchargements passent par le client HTTP partagé (client_http.py). Une page servie
+# par l'archive HTTP (rejeu ou secours) garde son adresse et sa date d'enregistrement.
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import client_http
+
+HEURE = 3600
+JOUR = 24 * HEURE
+
+# Règles de durée de vie par adresse : (préfixe, TTL, fenêtre stale-while-revalidate) en secondes
+# La première règle dont le préfixe correspond à l'URL s'applique
+REGLES_TTL = [
+    ("https://www.atmo-hdf.fr/air-commune/", HEURE, HEURE),
+    ("https://www.atmo-hdf.fr/article/", HEURE, 6 * HEURE),
+    ("https://www.atmo-hdf.fr/sites/", JOUR, 7 * JOUR),
+    ("https://www.atmo-france.org/article/", JOUR, JOUR),
+    ("https://nominatim.openstreetmap.org/", 7 * JOUR, 7 * JOUR),
+    ("https://raw.githubusercontent.com/", 7 * JOUR, 30 * JOUR),
+]
+TTL_DEFAUT = HEURE
+SWR_DEFAUT = HEURE
+OCTETS_MAX = 64 * 1024 * 1024
+
+
+# Réponse servie depuis le cache, avec les attributs de requests.Response utilisés par l'application
+class ReponseCache:
+    def __init__(self, entree, source):
+        self.status_code = entree['status_code']
+        self.content = entree['content']
+        self.headers = entree['headers']
+        self.encoding = entree['encoding']
+        self.url = entree['url']
+        # 'memoire', 'disque', 'reseau', 'revalidee' ou 'perimee'
+        self.source = source
+        # Page lue dans l'archive HTTP : adresse enregistrée et horodatage (None pour une page du site)
+        self.url_archivee = entree.get('url_archivee')
+        self.enregistree_a = entree.get('enregistree_a')
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} pour l'URL {self.url}")
+
+
+class CacheHTTP:
+    # timeout : (connexion, lecture) en secondes, None pour les délais par défaut du client HTTP
+    def __init__(self, octets_max=OCTETS_MAX, dossier=None, regles=REGLES_TTL, timeout=None):
+        self.octets_max = octets_max
+        self.dossier = dossier
+        self.regles = regles
+        self.timeout = timeout
+        self.entrees = OrderedDict()
+        self.octets = 0
+        self.verrou = threading.Lock()
+        # Un verrou par URL pour qu'un seul thread télécharge une même page à la fois ; il disparaît
+        # dès que plus aucun thread ne s'en sert (les pages des communes changent d'URL chaque jour)
+        self.verrous_url = weakref.WeakValueDictionary()
+        self.revalidations = set()
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cache-http')
+        self.statistiques = {'succes': 0, 'perimes': 0, 'echecs': 0, 'revalidations_304': 0}
+        if dossier:
+            os.makedirs(dossier, exist_ok=True)
+
+    # Fonction pour trouver le TTL et la fenêtre stale-while-revalidate d'une URL
+    def regle(self, url):
+        for prefixe, ttl, swr in self.regles:
+            if url.startswith(prefixe):
+                return ttl, swr
+        return TTL_DEFAUT, SWR_DEFAUT
+
+    def _chemin(self, url):
+        return os.path.join(self.dossier, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.pkl')
+
+    def _lire(self, url):
+        with self.verrou:
+            entree = self.entrees.get(url)
+            if entree is not None:
+                self.entrees.move_to_end(url)
+                return entree, 'memoire'
+        if self.dossier:
+            try:
+                with open(self._chemin(url), 'rb') as f:
+                    entree = pickle.load(f)
+            except (OSError, pickle.PickleError, EOFError):
+                return None, None
+            self._memoriser(url, entree)
+            return entree, 'disque'
+        return None, None
+
+    def _memoriser(self, url, entree):
+        with self.verrou:
+            ancienne = self.entrees.pop(url, None)
+            if ancienne is not None:
+                self.octets -= len(ancienne['content'])
+            self.entrees[url] = entree
+            self.octets += len(entree['content'])
+            # Éviction des entrées les moins récemment utilisées
+            while self.octets > self.octets_max and len(self.entrees) > 1:
+                _, evincee = self.entrees.popitem(last=False)
+                self.octets -= len(evincee['content'])
+
+    def _enregistrer(self, url, entree):
+        self._memoriser(url, entree)
+        if self.dossier:
+            chemin = self._chemin(url)
+            # Fichier temporaire propre au processus et au thread : le dossier peut être partagé par plusieurs workers
+            temporaire = f"{chemin}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(temporaire, 'wb') as f:
+                    pickle.dump(entree, f)
+                os.replace(temporaire, chemin)
+            except OSError as e:
+                print("Impossible d'écrire le cache HTTP sur disque :", e)
+
+    def _verrou_url(self, url):
+        with self.verrou:
+            return self.verrous_url.setdefault(url, threading.Lock())
+
+    # Fonction pour télécharger (ou revalider) une URL et mettre le cache à jour
+    def _telecharger(self, url, entree, tentatives=None):
+        entetes = {}
+        if entree is not None:
+            if entree['headers'].get('ETag'):
+                entetes['If-None-Match'] = entree['headers']['ETag']
+            if entree['headers'].get('Last-Modified'):
+                entetes['If-Modified-Since'] = entree['headers']['Last-Modified']
+        response = client_http.get(url, headers=entetes, timeout=self.timeout, tentatives=tentatives)
+        if response.status_code == 304 and entree is not None:
+            # Le site confirme le contenu : il n'est plus celui d'une archive ancienne
+            entree = dict(entree, stocke_a=time.time(), url_archivee=None, enregistree_a=None)
+            self._enregistrer(url, entree)
+            self.statistiques['revalidations_304'] += 1
+            return ReponseCache(entree, 'revalidee')
+        nouvelle = {
+            'url': url,
+            'status_code': response.status_code,
+            'content': response.content,
+            'headers': {cle: response.headers[cle] for cle in ('ETag', 'Last-Modified', 'Content-Type') if cle in response.headers},
+            'encoding': response.encoding,
+            'stocke_a': time.time(),
+            'url_archivee': response.url if getattr(response, 'source', None) == 'archive' else None,
+            'enregistree_a': getattr(response, 'enregistree_a', None),
+        }
+        # Seules les réponses valides sont mises en cache
+        if response.status_code == 200:
+            self._enregistrer(url, nouvelle)
+        return ReponseCache(nouvelle, 'reseau')
+
+    def _revalider_en_fond(self, url, entree, tentatives=None):
+        try:
+            self._telecharger(url, entree, tentatives)
+        except requests.RequestException:
+            self.statistiques['echecs'] += 1
+        finally:
+            with self.verrou:
+                self.revalidations.discard(url)
+
+    # Fonction pour récupérer une URL en passant par le cache
+    # tentatives : nombre d'essais du client HTTP (par défaut, ses propres reprises)
+    def get(self, url, tentatives=None):
+        ttl, swr = self.regle(url)
+        entree, source = self._lire(url)
+        if entree is not None:
+            age = time.time() - entree['stocke_a']
+            if age < ttl:
+                self.statistiques['succes'] += 1
+                return ReponseCache(entree, source)
+            if age < ttl + swr:
+                # Entrée périmée mais encore servable : on la renvoie et on la revalide en tâche de fond
+                self.statistiques['perimes'] += 1
+                with self.verrou:
+                    lancer = url not in self.revalidations
+                    self.revalidations.add(url)
+                if lancer:
+                    self.executor.submit(self._revalider_en_fond, url, entree, tentatives)
+                return ReponseCache(entree, 'perimee')
+
+        with self._verrou_url(url):
+            # Un autre thread a peut-être rempli le cache pendant qu'on attendait le verrou
+            entree_recente, source = self._lire(url)
+            if entree_recente is not None and time.time() - entree_recente['stocke_a'] < ttl:
+                self.statistiques['succes'] += 1
+                return ReponseCache(entree_recente, source)
+            try:
+                return self._telecharger(url, entree, tentatives)
+            except requests.RequestException:
+                self.statistiques['echecs'] += 1
+                # En cas d'erreur réseau, mieux vaut une donnée ancienne que rien
+                if entree is not None:
+                    return ReponseCache(entree, 'perimee')
+                raise
+
+
+# Cache partagé par toute l'application (stockage disque activé via la variable POLLEN_CACHE_HTTP)
+cache = CacheHTTP(dossier=os.environ.get('POLLEN_CACHE_HTTP'))
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+# Carte régionale du risque pollinique
+# Les contours des communes des Hauts-de-France viennent du magasin local de contours
+# (contours_communes.py), puis sont joints au snapshot du jour par une seule fusion
+# geopandas sur le code INSEE. Les contours ne sont envoyés qu'une fois, dans une seule
+# couche suivie de l'indice et de la catégorie de chaque taxon par commune : le choix
+# de la couche affichée (indice global ou un taxon) se fait dans le navigateur. La carte
+# est produite une fois à chaque rafraîchissement du snapshot, compressée, et servie à
+# toutes les sessions par une route Flask avec un ETag (l'iframe ne porte que son adresse).
+# Les cartes zoomées sur une commune sont gardées en mémoire dans un cache LRU, indexé
+# par (code INSEE, date des données, contour disponible) : aucun fichier temporaire partagé entre workers.
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import folium
+import pandas as pd
+from flask import Response, request
+from folium.map import Layer
+from jinja2 import Template
+from shapely.geometry import mapping
+
+import contours_communes
+import geometries_region
+
+FICHIER_DEPARTEMENTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'departements.geojson')
+CENTRE = [49.894483, 2.985636]
+# Niveau de zoom de la carte régionale, qui fixe la simplification des contours
+ZOOM = 7.5
+
+# Couleurs des catégories de risque par taxon (mêmes couleurs que le tableau de la commune)
+COULEURS_RISQUE = {
+    'Nul': '#ADD8E6',
+    'Faible': 'green',
+    'Moyen': 'yellow',
+    'Élevé': 'red',
+}
+COULEUR_INCONNUE = 'gray'
+# Taille maximale du cache des cartes zoomées (une carte de commune pèse quelques dizaines de Ko)
+OCTETS_MAX_RENDUS = 32 * 1024 * 1024
+CHEMIN = '/carte/region.html'
+# L'adresse de la carte change avec son contenu : le navigateur peut la garder une journée
+DUREE_CACHE = 24 * 3600
+
+# HTML d'une carte prêt à servir : texte, version compressée en gzip et ETag (empreinte du contenu)
+ContenuCarte = namedtuple('ContenuCarte', ['html', 'gzip', 'etag'])
+
+
+def preparer_contenu(html):
+    octets = html.encode('utf-8')
+    return ContenuCarte(octets, gzip.compress(octets, 6), hashlib.sha1(octets).hexdigest()[:16])
+
+
+# Fonction pour lire les contours des communes simplifiés pour la vue régionale (None s'ils ne sont pas encore chargés)
+def charger_communes():
+    magasin = contours_communes.contours()
+    if magasin is None:
+        return None
+    return magasin.geodataframe(contours_communes.tolerance_pour_zoom(ZOOM))
+
+
+# Fonction pour lire les contours des cinq départements de la région, découpés et simplifiés pour la vue régionale
+def charger_departements(chemin=FICHIER_DEPARTEMENTS):
+    return geometries_region.charger('departements', contours_communes.tolerance_pour_zoom(ZOOM), chemin)
+
+
+# Fonction pour transformer la table du snapshot en DataFrame : une ligne par commune,
+# une colonne par taxon contenant sa catégorie de risque
+def tableau_releves(table):
+    lignes = []
+    for code_insee, releve in table.items():
+        ligne = {'code': code_insee, 'indice': releve.indice, 'couleur': releve.couleur}
+        ligne.update(dict(releve.taxons))
+        lignes.append(ligne)
+    if not lignes:
+        return pd.DataFrame(columns=['code', 'indice', 'couleur'])
+    return pd.DataFrame(lignes)
+
+
+# Fonction pour écrire une valeur en JSON compact, sans risque de fermer la balise <script> qui la contient
+def json_compact(valeur):
+    return json.dumps(valeur, separators=(',', ':'), ensure_ascii=False).replace('<', '\\u003c')
+
+
+# Fonction pour obtenir les coordonnées d'une commune sous forme de MultiPolygon (liste de polygones)
+def coordonnees_multipolygone(geometrie):
+    coordonnees = mapping(geometrie)['coordinates']
+    return [coordonnees] if geometrie.geom_type == 'Polygon' else coordonnees
+
+
+# Couche unique des communes, écrite directement en JavaScript compact : les contours n'envoient que
+# leurs coordonnées, et les données du jour suivent en colonnes (une valeur par commune, dans l'ordre
+# des contours, les catégories des taxons étant numérotées). Le style et l'infobulle sont calculés dans
+# le navigateur, et le sélecteur change la couche affichée (indice global ou un taxon) sans rien
+# redemander au serveur
+class CoucheCommunes(Layer):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function() {
+            var contours = {{ this.contours }};
+            var donnees = {{ this.donnees }};
+            var couleurs = {{ this.couleurs|tojson }};
+            var inconnue = {{ this.inconnue|tojson }};
+            var actif = 'indice';
+            function valeur(i) {
+                return actif === 'indice' ? donnees.indices[i] : donnees.categories[donnees.taxons[actif][i]];
+            }
+            function styler(feature) {
+                var i = feature.properties.i;
+                var couleur = (actif === 'indice' ? donnees.couleurs[i] : couleurs[valeur(i)]) || inconnue;
+                return {fillColor: couleur, color: couleur, weight: 0.5, fillOpacity: 0.7};
+            }
+            var couche = L.geoJSON(contours.map(function(coordonnees, i) {
+                return {type: 'Feature', properties: {i: i}, geometry: {type: 'MultiPolygon', coordinates: coordonnees}};
+            }), {style: styler});
+            couche.bindTooltip(function(contour) {
+                var i = contour.feature.properties.i;
+                var v = valeur(i);
+                return donnees.noms[i] + ' — ' + (actif === 'indice' ? 'Indice' : actif) + ' : '
+                    + (v == null ? 'Indisponible' : v);
+            });
+            var controle = L.control({position: 'topright'});
+            controle.onAdd = function() {
+                var bloc = L.DomUtil.create('div', 'leaflet-bar');
+                var choix = L.DomUtil.create('select', '', bloc);
+                {{ this.choix|tojson }}.forEach(function(option) {
+                    var element = L.DomUtil.create('option', '', choix);
+                    element.value = option[0];
+                    element.textContent = option[1];
+                });
+                L.DomEvent.disableClickPropagation(bloc);
+                L.DomEvent.on(choix, 'change', function() {
+                    actif = choix.value;
+                    couche.setStyle(styler);
+                });
+                return bloc;
+            };
+            controle.addTo({{ this._parent.get_name() }});
+            return couche;
+        })();
+        {% endmacro %}
+    """)
+
+    # communes : contours joints aux relevés (colonnes nom, indice, couleur et une colonne par taxon)
+    def __init__(self, communes, taxons, name='Communes'):
+        super().__init__(name=name, overlay=True)
+        self._name = 'CoucheCommunes'
+        categories = sorted({categorie for taxon in taxons for categorie in communes[taxon].dropna()})
+        numeros = {categorie: numero for numero, categorie in enumerate(categories)}
+        self.contours = json_compact([coordonnees_multipolygone(geometrie) for geometrie in communes.geometry])
+        self.donnees = json_compact({
+            'noms': list(communes['nom']),
+            'indices': [None if pd.isna(indice) else int(indice) for indice in communes['indice']],
+            'couleurs': [None if pd.isna(couleur) else couleur for couleur in communes['couleur']],
+            'categories': categories,
+            'taxons': {taxon: [numeros.get(categorie) for categorie in communes[taxon]] for taxon in taxons},
+        })
+        self.couleurs = COULEURS_RISQUE
+        self.inconnue = COULEUR_INCONNUE
+        self.choix = [['indice', 'Indice pollinique']] + [[taxon, taxon] for taxon in taxons]
+
+
+class CartePollen:
+    # Les contours sont chargés au premier rafraîchissement, dans le thread du snapshot
+    # secours : HTML servi tant qu'aucun rafraîchissement n'a abouti (carte de base)
+    def __init__(self, communes=None, departements=None, secours=None):
+        self.communes = communes
+        self.departements = departements
+        self.secours = preparer_contenu(secours) if secours is not None else None
+        self.contenu_carte = None
+        self.date = None
+        self.attente = None
+        self.verrou = threading.Lock()
+
+    # Fonction pour joindre les relevés aux contours et calculer les couleurs de chaque couche
+    def joindre(self, table):
+        releves = tableau_releves(table)
+        taxons = [colonne for colonne in releves.columns if colonne not in ('code', 'indice', 'couleur')]
+        communes = self.communes.merge(releves, on='code', how='left')
+
+        # Par département, on retient l'indice (et sa couleur) le plus élevé parmi ses communes
+        maximums = (releves.assign(departement=releves['code'].str[:2])
+                    .dropna(subset=['indice'])
+                    .sort_values('indice')
+                    .drop_duplicates('departement', keep='last')[['departement', 'indice', 'couleur']])
+        departements = self.departements.merge(maximums, left_on='code', right_on='departement', how='left')
+        departements['couleur'] = departements['couleur'].fillna(COULEUR_INCONNUE)
+        return communes, departements, taxons
+
+    # Fonction pour produire la carte complète à partir de la table du snapshot
+    def generer(self, table):
+        communes, departements, taxons = self.joindre(table)
+        m = folium.Map(location=CENTRE, zoom_start=ZOOM)
+
+        folium.GeoJson(
+            departements[['nom', 'indice', 'couleur', 'geometry']].to_json(),
+            name='Départements',
+            style_function=lambda feature: {
+                'fillColor': feature['properties']['couleur'],
+                'color': 'black',
+                'weight': 2,
+                'fillOpacity': 0.5,
+            },
+            tooltip=folium.GeoJsonTooltip(fields=['nom', 'indice'], aliases=['Département', 'Indice max']),
+            show=False,
+        ).add_to(m)
+
+        # Une seule couche de communes : le style et l'infobulle sont calculés dans le navigateur
+        CoucheCommunes(communes, taxons).add_to(m)
+
+        # Contours des départements toujours visibles par-dessus les couches
+        folium.GeoJson(
+            departements[['nom', 'geometry']].to_json(),
+            name='Limites des départements',
+            style_function=lambda feature: {'fillOpacity': 0, 'color': 'black', 'weight': 2},
+            control=False,
+        ).add_to(m)
+
+        folium.LayerControl(collapsed=False).add_to(m)
+        return m.get_root().render()
+
+    # Fonction appelée par le snapshot à la fin de chaque rafraîchissement
+    def rafraichir(self, snapshot):
+        if self.communes is None:
+            self.communes = charger_communes()
+            if self.communes is None:
+                self._attendre_contours(snapshot)
+                return
+        if self.departements is None:
+            self.departements = charger_departements()
+        date, table = snapshot.releves()
+        # Seuls les relevés du jour sont colorés (pas ceux d'une page d'archive plus ancienne)
+        table = {code: releve for code, releve in table.items() if releve.date == date}
+        contenu = preparer_contenu(self.generer(table))
+        with self.verrou:
+            self.contenu_carte = contenu
+            self.date = date
+
+    # Contours pas encore chargés : la carte sera produite dès qu'ils le seront, dans un thread
+    # à part pour ne pas retenir les autres abonnés du snapshot
+    def _attendre_contours(self, snapshot):
+        with self.verrou:
+            if self.attente is not None:
+                return
+            self.attente = threading.Thread(target=self._rafraichir_apres_contours, args=(snapshot,),
+                                            name='carte-contours', daemon=True)
+            self.attente.start()
+
+    def _rafraichir_apres_contours(self, snapshot):
+        contours_communes.attendre()
+        with self.verrou:
+            self.attente = None
+        try:
+            self.rafraichir(snapshot)
+        except Exception as e:
+            print("Échec de la production de la carte régionale :", e)
+
+    # Fonction pour lire la carte prête à servir (la carte de secours tant qu'aucun rafraîchissement n'a abouti)
+    def contenu(self):
+        with self.verrou:
+            return self.contenu_carte or self.secours
+
+    # Fonction pour obtenir l'adresse de la carte, qui change avec son contenu
+    def url(self, chemin=CHEMIN):
+        contenu = self.contenu()
+        return f"{chemin}?v={contenu.etag}" if contenu is not None else chemin
+
+
+# Fonction pour déclarer la route qui sert la carte régionale sur le serveur Flask de l'application Dash
+# (réponse 304 si le navigateur a déjà cette version, gzip si le navigateur l'accepte)
+def exposer(app, carte, chemin=CHEMIN):
+    def servir():
+        contenu = carte.contenu()
+        if contenu is None:
+            return "La carte régionale n'est pas encore disponible", 503, {'Retry-After': '60'}
+        entetes = {
+            'ETag': f'"{contenu.etag}"',
+            'Cache-Control': f'public, max-age={DUREE_CACHE}',
+            'Vary': 'Accept-Encoding',
+        }
+        if request.if_none_match.contains(contenu.etag):
+            return Response(status=304, headers=entetes)
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            entetes['Content-Encoding'] = 'gzip'
+            return Response(contenu.gzip, content_type='text/html; charset=utf-8', headers=entetes)
+        return Response(contenu.html, content_type='text/html; charset=utf-8', headers=entetes)
+    app.server.add_url_rule(chemin, 'carte_regionale', servir)
+
+
+# Cache LRU en mémoire du HTML des cartes déjà produites, limité en taille
+class CacheRendus:
+    def __init__(self, octets_max=OCTETS_MAX_RENDUS):
+        self.octets_max = octets_max
+        self.entrees = OrderedDict()
+        self.octets = 0
+        self.verrou = threading.Lock()
+        self.statistiques = {'succes': 0, 'echecs': 0, 'evictions': 0}
+
+    def obtenir(self, cle):
+        with self.verrou:
+            html = self.entrees.get(cle)
+            if html is None:
+                self.statistiques['echecs'] += 1
+                return None
+            self.entrees.move_to_end(cle)
+            self.statistiques['succes'] += 1
+            return html
+
+    def enregistrer(self, cle, html):
+        with self.verrou:
+            ancien = self.entrees.pop(cle, None)
+            if ancien is not None:
+                self.octets -= len(ancien)
+            self.entrees[cle] = html
+            self.octets += len(html)
+            # Éviction des cartes les moins récemment demandées
+            while self.octets > self.octets_max and len(self.entrees) > 1:
+                _, evince = self.entrees.popitem(last=False)
+                self.octets -= len(evince)
+                self.statistiques['evictions'] += 1
+
+    # Fonction pour lire une carte du cache, en la produisant avec fonction() si elle est absente
+    def obtenir_ou_generer(self, cle, fonction):
+        html = self.obtenir(cle)
+        if html is None:
+            html = fonction()
+            self.enregistrer(cle, html)
+        return html
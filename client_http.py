@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+# Client HTTP partagé pour tous les appels vers l'extérieur
+# Une seule session requests garde un pool de connexions par hôte (keep-alive : pas de
+# nouvelle poignée de main TLS à chaque page). Chaque requête a un délai de connexion et
+# un délai de lecture, les erreurs réseau et les réponses 429/5xx sont réessayées un nombre
+# limité de fois avec une attente exponentielle aléatoire, et un disjoncteur par hôte coupe
+# les appels pendant un moment quand un site ne répond plus, au lieu de bloquer les workers.
+# Une archive locale (archive_http.py) peut enregistrer les réponses, les rejouer hors ligne
+# ou prendre le relais quand un hôte est en panne.
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import archive_http
+import metriques
+
+# Délais en secondes, réglables par variables d'environnement
+TIMEOUT_CONNEXION = float(os.environ.get('POLLEN_TIMEOUT_CONNEXION', 5))
+TIMEOUT_LECTURE = float(os.environ.get('POLLEN_TIMEOUT_LECTURE', 15))
+TENTATIVES = 3
+DELAI_BASE = 0.5
+# Connexions gardées ouvertes par hôte (au moins le nombre de threads du crawl)
+CONNEXIONS_PAR_HOTE = 16
+# Le disjoncteur s'ouvre après 5 échecs consécutifs sur un hôte et reste ouvert 60 secondes
+SEUIL_DISJONCTEUR = 5
+DUREE_DISJONCTEUR = 60
+CODES_A_REESSAYER = {429, 500, 502, 503, 504}
+ENTETES_CONDITIONNELS = ('If-None-Match', 'If-Modified-Since')
+USER_AGENT = 'tdb-pollens/1.0 (+https://github.com/annelaureyvon/tdb_pollens)'
+
+
+# Erreur levée sans appel réseau quand le disjoncteur d'un hôte est ouvert
+# (sous-classe de RequestException pour être traitée comme une erreur réseau ordinaire)
+class CircuitOuvert(requests.RequestException):
+    pass
+
+
+# Disjoncteur d'un hôte : compte les échecs consécutifs et bloque les appels pendant une durée donnée
+class Disjoncteur:
+    def __init__(self, seuil=SEUIL_DISJONCTEUR, duree=DUREE_DISJONCTEUR):
+        self.seuil = seuil
+        self.duree = duree
+        self.echecs = 0
+        self.ouvert_jusqua = 0.0
+        self.verrou = threading.Lock()
+
+    # Fonction pour savoir si un appel est autorisé (un seul essai est laissé passer à l'expiration)
+    def autoriser(self):
+        with self.verrou:
+            if self.echecs < self.seuil:
+                return True
+            maintenant = time.monotonic()
+            if maintenant >= self.ouvert_jusqua:
+                self.ouvert_jusqua = maintenant + self.duree
+                return True
+            return False
+
+    def succes(self):
+        with self.verrou:
+            self.echecs = 0
+
+    def echec(self):
+        with self.verrou:
+            self.echecs += 1
+            if self.echecs == self.seuil:
+                self.ouvert_jusqua = time.monotonic() + self.duree
+
+
+class ClientHTTP:
+    def __init__(self, timeout_connexion=TIMEOUT_CONNEXION, timeout_lecture=TIMEOUT_LECTURE,
+                 tentatives=TENTATIVES, delai_base=DELAI_BASE, connexions_par_hote=CONNEXIONS_PAR_HOTE, archive=None):
+        self.archive = archive
+        self.timeout = (timeout_connexion, timeout_lecture)
+        self.tentatives = tentatives
+        self.delai_base = delai_base
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adaptateur = HTTPAdapter(pool_connections=8, pool_maxsize=connexions_par_hote, max_retries=0)
+        self.session.mount('https://', adaptateur)
+        self.session.mount('http://', adaptateur)
+        self.disjoncteurs = {}
+        self.verrou = threading.Lock()
+        self.statistiques = {'requetes': 0, 'tentatives_supplementaires': 0, 'echecs': 0, 'refus_disjoncteur': 0}
+
+    def disjoncteur(self, url):
+        hote = urlsplit(url).netloc
+        with self.verrou:
+            return self.disjoncteurs.setdefault(hote, Disjoncteur())
+
+    # Fonction pour obtenir l'état des disjoncteurs (hôte -> nombre d'échecs consécutifs)
+    def etat(self):
+        with self.verrou:
+            return {hote: d.echecs for hote, d in self.disjoncteurs.items()}
+
+    # Fonction pour envoyer une requête GET en passant par l'archive si elle est active
+    # tentatives : nombre d'essais pour cet appel (1 quand l'appelant gère lui-même les reprises)
+    def get(self, url, headers=None, timeout=None, tentatives=None):
+        archive = self.archive
+        if archive is None:
+            return self._get_reseau(url, headers, timeout, tentatives)
+        if archive.mode == archive_http.REJOUER:
+            return archive.rejouer(url)
+        # Une réponse 304 n'a pas de contenu à archiver : sans copie dans l'archive, on redemande la page entière
+        if headers and any(entete in headers for entete in ENTETES_CONDITIONNELS) and archive.lire(url) is None:
+            headers = {cle: valeur for cle, valeur in headers.items() if cle not in ENTETES_CONDITIONNELS}
+        try:
+            response = self._get_reseau(url, headers, timeout, tentatives)
+        except requests.RequestException:
+            if archive.mode == archive_http.SECOURS:
+                secours = archive.secourir(url)
+                if secours is not None:
+                    return secours
+            raise
+        if response.status_code == 200:
+            archive.enregistrer(url, response)
+        elif archive.mode == archive_http.SECOURS and response.status_code in CODES_A_REESSAYER:
+            return archive.secourir(url) or response
+        return response
+
+    # Fonction pour envoyer une requête GET avec délais, reprises et disjoncteur
+    # Chaque issue est comptée par hôte (succes, reprise, echec, refus) pour suivre les taux d'erreur
+    def _get_reseau(self, url, headers=None, timeout=None, tentatives=None):
+        tentatives = tentatives or self.tentatives
+        hote = urlsplit(url).netloc
+        disjoncteur = self.disjoncteur(url)
+        if not disjoncteur.autoriser():
+            self.statistiques['refus_disjoncteur'] += 1
+            metriques.compter('requete_amont', hote=hote, resultat='refus')
+            raise CircuitOuvert(f"Hôte indisponible, appels suspendus : {hote}")
+        self.statistiques['requetes'] += 1
+        for tentative in range(tentatives):
+            try:
+                with metriques.mesurer('requete_amont', hote=hote):
+                    response = self.session.get(url, headers=headers, timeout=timeout or self.timeout)
+                if response.status_code not in CODES_A_REESSAYER:
+                    disjoncteur.succes()
+                    metriques.compter('requete_amont', hote=hote, resultat='succes')
+                    return response
+                erreur = None
+            except requests.RequestException as e:
+                response = None
+                erreur = e
+            if tentative == tentatives - 1:
+                break
+            self.statistiques['tentatives_supplementaires'] += 1
+            metriques.compter('requete_amont', hote=hote, resultat='reprise')
+            # Attente exponentielle avec un peu d'aléa pour ne pas resynchroniser les appels
+            time.sleep(self.delai_base * (2 ** tentative) + random.uniform(0, self.delai_base))
+        self.statistiques['echecs'] += 1
+        metriques.compter('requete_amont', hote=hote, resultat='echec')
+        disjoncteur.echec()
+        if erreur is not None:
+            raise erreur
+        return response
+
+
+# Client partagé par toute l'application
+client = ClientHTTP(archive=archive_http.depuis_environnement())
+
+
+def get(url, headers=None, timeout=None, tentatives=None):
+    return client.get(url, headers=headers, timeout=timeout, tentatives=tentatives)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# Contours des communes des Hauts-de-France
+# Les polygones sont lus une seule fois depuis le fichier GeoJSON local (téléchargé au
+# premier lancement s'il est absent) et indexés par code INSEE. Les contours simplifiés à
+# chaque tolérance sont préparés une fois par geometries_region.py (frontières partagées
+# simplifiées ensemble, coordonnées arrondies) pour servir une géométrie adaptée au niveau
+# de zoom, et un index spatial R-tree (STRtree de shapely) permet de retrouver la commune qui
+# contient un point. Plus aucune requête Nominatim n'est nécessaire pour tracer une commune.
+# Le téléchargement et la lecture se font dans un thread de fond, avec un nouvel essai en cas
+# d'échec : les callbacks ne les attendent jamais et tracent la carte sans contour en attendant.
+import os
+import threading
+import time
+
+import geopandas as gpd
+from shapely.geometry import Point, mapping
+from shapely.strtree import STRtree
+
+import geometries_region
+from cache_http import cache
+from geometries_region import tolerance_pour_zoom
+
+URL_COMMUNES = "https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/regions/hauts-de-france/communes-hauts-de-france.geojson"
+FICHIER_COMMUNES = geometries_region.SOURCES['communes']
+
+# Tolérances de simplification (en degrés) selon le niveau de zoom minimal de la carte
+TOLERANCES = [(zoom_min, tolerance) for zoom_min, tolerance, _ in geometries_region.NIVEAUX]
+# Délai avant un nouvel essai quand les contours n'ont pas pu être téléchargés ou lus (en secondes)
+INTERVALLE_NOUVEL_ESSAI = 300
+
+
+# Fonction pour télécharger le fichier des contours s'il n'est pas encore présent
+def telecharger_fichier(chemin=FICHIER_COMMUNES):
+    if os.path.exists(chemin):
+        return
+    response = cache.get(URL_COMMUNES)
+    response.raise_for_status()
+    # Fichier temporaire propre au processus et au thread : plusieurs workers peuvent télécharger en même temps
+    temporaire = f"{chemin}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporaire, 'wb') as f:
+        f.write(response.content)
+    os.replace(temporaire, chemin)
+
+
+class ContoursCommunes:
+    def __init__(self, chemin=FICHIER_COMMUNES):
+        telecharger_fichier(chemin)
+        # Géométries simplifiées, préparées une fois pour chaque tolérance
+        niveaux = {tolerance: geometries_region.charger('communes', tolerance, chemin) for _, tolerance in TOLERANCES}
+        self.simplifiees = {tolerance: dict(zip(niveau['code'], niveau.geometry)) for tolerance, niveau in niveaux.items()}
+        # La table des communes et l'index spatial s'appuient sur le niveau le plus fin
+        communes = niveaux[TOLERANCES[0][1]]
+        communes['departement'] = communes['code'].str[:2]
+        self.communes = communes.set_index('code', drop=False)
+        self.codes = list(self.communes['code'])
+        self.arbre = STRtree(list(self.communes.geometry))
+
+    # Fonction pour obtenir le contour d'une commune au format GeoJSON (None si le code est inconnu)
+    def contour(self, code_commune_INSEE, zoom=12):
+        geometrie = self.simplifiees[tolerance_pour_zoom(zoom)].get(code_commune_INSEE)
+        if geometrie is None:
+            return None
+        return mapping(geometrie)
+
+    # Fonction pour obtenir toutes les communes simplifiées à une tolérance donnée (GeoDataFrame)
+    def geodataframe(self, tolerance):
+        communes = self.communes.reset_index(drop=True)
+        communes['geometry'] = communes['code'].map(self.simplifiees[tolerance])
+        return gpd.GeoDataFrame(communes, geometry='geometry', crs=self.communes.crs)
+
+    # Fonction pour retrouver le code INSEE de la commune contenant un point (None hors de la région)
+    def commune_au_point(self, latitude, longitude):
+        point = Point(longitude, latitude)
+        for i in self.arbre.query(point, predicate='intersects'):
+            return self.codes[i]
+        return None
+
+
+_contours = None
+_pret = threading.Event()
+_verrou = threading.Lock()
+_thread = None
+
+
+def _charger():
+    global _contours
+    while True:
+        try:
+            _contours = ContoursCommunes()
+            _pret.set()
+            return
+        except Exception as e:
+            print("Échec du chargement des contours des communes :", e)
+        time.sleep(INTERVALLE_NOUVEL_ESSAI)
+
+
+# Fonction pour lancer le chargement des contours en tâche de fond (une seule fois)
+def charger_en_fond():
+    global _thread
+    with _verrou:
+        if _thread is None:
+            _thread = threading.Thread(target=_charger, name='contours-communes', daemon=True)
+            _thread.start()
+
+
+# Fonction pour obtenir le magasin de contours partagé, sans attendre (None tant qu'il n'est pas chargé)
+def contours():
+    return _contours
+
+
+# Fonction pour attendre la fin du chargement (None si le délai expire avant)
+def attendre(delai=None):
+    _pret.wait(delai)
+    return _contours
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+# Démarrage de l'application sans attendre le réseau
+# La table des communes est lue depuis le fichier local villes_hauts_de_france_modifie.csv
+# et la carte de base depuis les départements de la région, découpés et simplifiés une
+# fois par geometries_region.py à partir de departements.geojson. Le résultat préparé est
+# enregistré dans un cache binaire (pickle) pour que les démarrages suivants n'aient plus
+# qu'à le relire. Les copies distantes (CSV sur Google Drive, contours des communes) sont
+# rafraîchies en tâche de fond : la copie du CSV est rangée dans .cache_demarrage/ (le
+# fichier suivi par git n'est jamais réécrit) et prise en compte au démarrage suivant si
+# elle est la plus récente.
+import os
+import pickle
+import sys
+import threading
+import time
+
+import folium
+import pandas as pd
+import requests
+
+from cache_http import cache
+import contours_communes
+import geometries_region
+
+# Début du démarrage : l'import de ce module est l'une des premières étapes de l'application
+DEBUT = time.perf_counter()
+
+DOSSIER = os.path.dirname(os.path.abspath(__file__))
+FICHIER_VILLES = os.path.join(DOSSIER, 'villes_hauts_de_france_modifie.csv')
+FICHIER_DEPARTEMENTS = os.path.join(DOSSIER, 'departements.geojson')
+URL_VILLES = "https://drive.google.com/uc?export=download&id=1B0it1rkyEXHtbqesq5_NP4pHFuSiLoY4"
+DOSSIER_CACHE = os.environ.get('POLLEN_CACHE_DEMARRAGE', os.path.join(DOSSIER, '.cache_demarrage'))
+FICHIER_VILLES_DISTANT = os.path.join(DOSSIER_CACHE, 'villes_hauts_de_france_distant.csv')
+CENTRE = [49.894483, 2.985636]
+
+# Version du format de la table en cache : à incrémenter quand la préparation change
+VERSION_TABLE = 2
+# Budget mémoire de la table des communes par worker Dash (chaque worker garde sa propre copie).
+# La table compacte des ~3 950 communes occupe environ 0,6 Mo, contre 1,3 Mo pour le
+# DataFrame brut lu depuis le CSV ; un dépassement du budget est signalé au démarrage.
+BUDGET_MEMOIRE_TABLE = 1024 * 1024
+
+# Durée de chaque étape du démarrage, en secondes
+mesures = {}
+
+
+# Fonction pour lire un objet du cache binaire s'il est plus récent que le fichier source
+def lire_cache(nom, source):
+    chemin = os.path.join(DOSSIER_CACHE, nom + '.pkl')
+    try:
+        if os.path.getmtime(chemin) < os.path.getmtime(source):
+            return None
+        with open(chemin, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.PickleError, EOFError):
+        return None
+
+
+# Fonction pour enregistrer un objet dans le cache binaire de façon atomique
+def ecrire_cache(nom, objet):
+    chemin = os.path.join(DOSSIER_CACHE, nom + '.pkl')
+    # Fichier temporaire propre au processus et au thread : les workers démarrent en même temps
+    temporaire = f"{chemin}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(DOSSIER_CACHE, exist_ok=True)
+        with open(temporaire, 'wb') as f:
+            pickle.dump(objet, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporaire, chemin)
+    except OSError as e:
+        print("Impossible d'écrire le cache de démarrage :", e)
+
+
+# Fonction pour ajuster les noms de communes (espaces remplacés par des tirets)
+def ajuster_nom_commune(nom_commune):
+    return nom_commune.replace(" ", "-")
+
+
+# Fonction pour réduire l'empreinte mémoire de la table des communes :
+# - la colonne 'nom_département' (copie de 'nom_departement' ajoutée par preparation_communes.py) est supprimée
+# - les départements et les codes postaux, très répétés, deviennent des catégories
+# - les codes INSEE sont complétés sur 5 caractères et les noms sont internés
+# - les coordonnées passent en float32 (précision d'environ 1 m, suffisante pour centrer une carte)
+def compacter_communes(data):
+    data = data.drop(columns=['nom_département'], errors='ignore')
+    data['nom_commune_postal'] = [sys.intern(nom) for nom in data['nom_commune_postal']]
+    data['code_commune_INSEE'] = [sys.intern(str(code).zfill(5)) for code in data['code_commune_INSEE']]
+    data['code_postal'] = data['code_postal'].astype(str).str.zfill(5).astype('category')
+    data['nom_departement'] = data['nom_departement'].astype('category')
+    data['latitude'] = data['latitude'].astype('float32')
+    data['longitude'] = data['longitude'].astype('float32')
+    return data.reset_index(drop=True)
+
+
+# Fonction pour mesurer la mémoire occupée par une table (en octets, chaînes comprises)
+def memoire(data):
+    return int(data.memory_usage(deep=True).sum())
+
+
+# Fonction pour choisir le fichier des communes à lire : la copie distante si elle est plus récente
+# que le fichier préparé localement (preparation_communes.py), sinon ce dernier
+def fichier_villes():
+    if not os.path.exists(FICHIER_VILLES_DISTANT):
+        return FICHIER_VILLES
+    if not os.path.exists(FICHIER_VILLES) or os.path.getmtime(FICHIER_VILLES_DISTANT) > os.path.getmtime(FICHIER_VILLES):
+        return FICHIER_VILLES_DISTANT
+    return FICHIER_VILLES
+
+
+# Fonction pour charger la table des communes préparée
+def charger_communes():
+    debut = time.perf_counter()
+    fichier = fichier_villes()
+    distant = fichier == FICHIER_VILLES_DISTANT
+    nom_cache = f'communes_v{VERSION_TABLE}' + ('_distant' if distant else '')
+    data = lire_cache(nom_cache, fichier)
+    source = 'cache'
+    if data is None:
+        data = pd.read_csv(fichier, dtype={'code_postal': str, 'code_commune_INSEE': str})
+        data['nom_commune_postal'] = data['nom_commune_postal'].apply(ajuster_nom_commune)
+        data = compacter_communes(data)
+        ecrire_cache(nom_cache, data)
+        source = 'csv distant' if distant else 'csv'
+    mesures['communes'] = (time.perf_counter() - debut, source)
+    octets = memoire(data)
+    if octets > BUDGET_MEMOIRE_TABLE:
+        print(f"La table des communes occupe {octets / 1024:.0f} Ko, au-delà du budget de {BUDGET_MEMOIRE_TABLE / 1024:.0f} Ko")
+    return data
+
+
+# Fonction pour produire le HTML de la carte de base (contours des départements de la région)
+def carte_base():
+    debut = time.perf_counter()
+    nom_cache = f'carte_base_v{geometries_region.VERSION}'
+    html_carte = lire_cache(nom_cache, FICHIER_DEPARTEMENTS)
+    source = 'cache'
+    if html_carte is None:
+        departements = geometries_region.charger(
+            'departements', contours_communes.tolerance_pour_zoom(7.5), FICHIER_DEPARTEMENTS)
+        m = folium.Map(location=CENTRE, zoom_start=7.5)
+        folium.GeoJson(
+            departements.to_json(),
+            name='geojson',
+            style_function=lambda x: {'fillOpacity': 0, 'color': 'black', 'weight': 2}
+        ).add_to(m)
+        html_carte = m.get_root().render()
+        ecrire_cache(nom_cache, html_carte)
+        source = 'geojson'
+    mesures['carte_base'] = (time.perf_counter() - debut, source)
+    return html_carte
+
+
+# Fonction pour enregistrer la copie distante du CSV dans le cache de démarrage si elle diffère du fichier lu
+def rafraichir_villes():
+    response = cache.get(URL_VILLES)
+    response.raise_for_status()
+    # Google Drive renvoie parfois une page HTML (quota, avertissement) au lieu du fichier
+    if not response.content.startswith(b'nom_commune_postal'):
+        print("Le fichier des communes téléchargé n'est pas un CSV valide")
+        return False
+    with open(fichier_villes(), 'rb') as f:
+        if f.read() == response.content:
+            return False
+    os.makedirs(DOSSIER_CACHE, exist_ok=True)
+    temporaire = f"{FICHIER_VILLES_DISTANT}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporaire, 'wb') as f:
+        f.write(response.content)
+    os.replace(temporaire, FICHIER_VILLES_DISTANT)
+    return True
+
+
+def _rafraichir_en_fond():
+    try:
+        if rafraichir_villes():
+            print("Nouvelle version du fichier des communes, prise en compte au prochain démarrage")
+    except (requests.RequestException, OSError) as e:
+        print("Échec du rafraîchissement du fichier des communes :", e)
+
+
+# Fonction pour lancer le rafraîchissement des copies distantes en tâche de fond
+# (les contours des communes sont téléchargés et indexés avant la première sélection)
+def rafraichir_en_fond():
+    threading.Thread(target=_rafraichir_en_fond, name='demarrage', daemon=True).start()
+    contours_communes.charger_en_fond()
+
+
+# Fonction pour afficher la durée du démarrage à froid et de ses étapes
+def rapport():
+    duree = time.perf_counter() - DEBUT
+    etapes = ", ".join(f"{nom} : {temps:.3f} s ({source})" for nom, (temps, source) in mesures.items())
+    print(f"Application prête en {duree:.3f} s ({etapes})")
+    return duree
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+# Export en masse du snapshot pollinique régional
+# Les routes /export/pollens.csv, /export/pollens.ndjson et /export/pollens.parquet du serveur
+# Flask de Dash renvoient une ligne par commune et par taxon, jointe à la table des communes
+# (code INSEE, code postal, département, coordonnées). La réponse est produite par morceaux
+# de quelques centaines de communes : le fichier exporté n'est jamais construit en entier en mémoire.
+# Le CSV et le NDJSON sont compressés en gzip à la volée si le client l'accepte ; l'ETag est
+# construit sur la date du snapshot, et un client qui a déjà la version du jour reçoit un 304.
+import csv
+import io
+import json
+import zlib
+
+from flask import Response, request
+
+from historique_pollen import NIVEAUX
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+CHEMIN = '/export/pollens.<format_export>'
+COMMUNES_PAR_MORCEAU = 250
+DUREE_CACHE = 300
+COLONNES = ['code_insee', 'commune', 'code_postal', 'departement', 'latitude', 'longitude',
+            'date', 'indice', 'couleur', 'risque_departement', 'taxon', 'categorie', 'niveau']
+TYPES_CONTENU = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+# Fonction pour produire les lignes de l'export par morceaux (listes de dictionnaires)
+def morceaux(releves, index, communes_par_morceau=COMMUNES_PAR_MORCEAU):
+    morceau = []
+    for numero, code_insee in enumerate(sorted(releves), start=1):
+        releve = releves[code_insee]
+        commune = index.par_insee.get(code_insee)
+        base = {
+            'code_insee': code_insee,
+            'commune': commune.nom if commune else None,
+            'code_postal': commune.code_postal if commune else None,
+            'departement': commune.departement if commune else None,
+            # Coordonnées gardées en float32 dans la table : 6 décimales (environ 10 cm) suffisent
+            'latitude': round(commune.latitude, 6) if commune else None,
+            'longitude': round(commune.longitude, 6) if commune else None,
+            'date': releve.date,
+            'indice': releve.indice,
+            'couleur': releve.couleur,
+            'risque_departement': releve.departement,
+        }
+        for taxon, categorie in releve.taxons or [(None, None)]:
+            morceau.append(dict(base, taxon=taxon, categorie=categorie, niveau=NIVEAUX.get(categorie)))
+        if numero % communes_par_morceau == 0:
+            yield morceau
+            morceau = []
+    if morceau:
+        yield morceau
+
+
+def flux_csv(lignes):
+    tampon = io.StringIO()
+    ecrivain = csv.DictWriter(tampon, fieldnames=COLONNES, lineterminator='\n')
+    ecrivain.writeheader()
+    for morceau in lignes:
+        ecrivain.writerows(morceau)
+        yield tampon.getvalue().encode('utf-8')
+        tampon.seek(0)
+        tampon.truncate()
+    if tampon.tell():
+        yield tampon.getvalue().encode('utf-8')
+
+
+def flux_ndjson(lignes):
+    for morceau in lignes:
+        yield ''.join(json.dumps(ligne, ensure_ascii=False) + '\n' for ligne in morceau).encode('utf-8')
+
+
+# Fichier minimal en écriture seule : les octets écrits par pyarrow sont repris après chaque groupe de lignes
+class TamponFlux(io.RawIOBase):
+    def __init__(self):
+        self.parties = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, octets):
+        self.parties.append(bytes(octets))
+        self.position += len(octets)
+        return len(octets)
+
+    def tell(self):
+        return self.position
+
+    def vider(self):
+        octets = b''.join(self.parties)
+        self.parties = []
+        return octets
+
+
+# Un groupe de lignes Parquet par morceau
+def flux_parquet(lignes):
+    schema = pa.schema([
+        ('code_insee', pa.string()), ('commune', pa.string()), ('code_postal', pa.string()),
+        ('departement', pa.string()), ('latitude', pa.float32()), ('longitude', pa.float32()),
+        ('date', pa.string()), ('indice', pa.int8()), ('couleur', pa.string()),
+        ('risque_departement', pa.string()), ('taxon', pa.string()), ('categorie', pa.string()),
+        ('niveau', pa.int8()),
+    ])
+    tampon = TamponFlux()
+    with pq.ParquetWriter(tampon, schema) as ecrivain:
+        for morceau in lignes:
+            ecrivain.write_table(pa.Table.from_pylist(morceau, schema=schema))
+            yield tampon.vider()
+    yield tampon.vider()
+
+
+def compresser(flux):
+    compresseur = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for octets in flux:
+        compresse = compresseur.compress(octets)
+        if compresse:
+            yield compresse
+    yield compresseur.flush()
+
+
+FLUX = {
+    'csv': flux_csv,
+    'ndjson': flux_ndjson,
+    'parquet': flux_parquet,
+}
+
+
+# Fonction pour déclarer les routes d'export sur le serveur Flask de l'application Dash
+def exposer(app, snapshot, index, chemin=CHEMIN):
+    def exporter(format_export):
+        if format_export not in FLUX:
+            return f"Format inconnu : {format_export} (csv, ndjson ou parquet)", 404
+        if format_export == 'parquet' and pa is None:
+            return "L'export Parquet nécessite pyarrow, non installé sur ce serveur", 501
+        date, table = snapshot.releves()
+        if date is None:
+            return "Le snapshot du jour n'est pas encore disponible", 503, {'Retry-After': '60'}
+        releves = {code: releve for code, releve in table.items() if releve.date == date}
+        # Le Parquet est déjà compressé : seuls le CSV et le NDJSON passent par gzip
+        gzip = format_export != 'parquet' and 'gzip' in request.headers.get('Accept-Encoding', '')
+        etag = f"{date}-{format_export}-{len(releves)}" + ('-gzip' if gzip else '')
+        entetes = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': f'public, max-age={DUREE_CACHE}',
+            'Vary': 'Accept-Encoding',
+            'Content-Disposition': f'attachment; filename="pollens-{date}.{format_export}"',
+        }
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=entetes)
+        flux = FLUX[format_export](morceaux(releves, index))
+        if gzip:
+            flux = compresser(flux)
+            entetes['Content-Encoding'] = 'gzip'
+        return Response(flux, content_type=TYPES_CONTENU[format_export], headers=entetes)
+    app.server.add_url_rule(chemin, 'export_pollens', exporter)
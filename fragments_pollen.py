@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# Tableaux des pollens par commune, produits à l'avance
+# Le tableau d'une commune (une ligne par taxon avec sa pastille de couleur) ne dépend que de
+# la liste des taxons et de leur catégorie de risque. Après chaque rafraîchissement du snapshot,
+# le tableau de chaque commune est produit et déjà converti en JSON (dictionnaires simples) ;
+# les communes qui ont les mêmes relevés partagent le même fragment. Le callback n'a plus qu'à
+# renvoyer ce fragment, sans reconstruire ni reparcourir l'arbre des composants Dash.
+import json
+import threading
+
+import plotly
+from dash import html
+
+import metriques
+from carte_pollen import COULEURS_RISQUE, COULEUR_INCONNUE
+
+STYLE_PASTILLE = {'height': '20px', 'width': '20px', 'borderRadius': '50%', 'display': 'inline-block',
+                  'marginRight': '10px', 'marginLeft': '40px'}
+
+
+# Fonction pour convertir le niveau de risque en couleur
+def couleur_risque(categorie):
+    return COULEURS_RISQUE.get(categorie, COULEUR_INCONNUE)
+
+
+# Fonction pour construire le tableau des pollens d'une commune
+def tableau_pollens(taxons):
+    output_rows = []
+    for nom_pollen, nom_categorie in taxons:
+        color_circle = html.Span(style=dict(STYLE_PASTILLE, backgroundColor=couleur_risque(nom_categorie)))
+        output_rows.append(html.Tr([html.Td(nom_pollen), html.Td([color_circle, nom_categorie])]))
+        output_rows.append(html.Tr([html.Td('', style={'height': '10px'})]))  # Ligne vide avec hauteur
+
+    return html.Table([
+        html.Thead(html.Tr([html.Th("Pollen"), html.Th("Risque")])),
+        html.Tbody(output_rows)
+    ])
+
+
+# Fonction pour convertir un composant Dash en dictionnaires simples, tels qu'envoyés au navigateur
+def serialiser(composant):
+    return json.loads(json.dumps(composant, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+class FragmentsPollen:
+    def __init__(self):
+        # Relevé (taxons et catégories) -> fragment JSON du tableau
+        self.par_taxons = {}
+        # Code INSEE -> (date du relevé, fragment JSON du tableau)
+        self.par_commune = {}
+        self.verrou = threading.Lock()
+        # Lectures du prérendu (compteurs)
+        self.statistiques = {'succes': 0, 'echecs': 0}
+
+    def _fragment(self, par_taxons, taxons):
+        fragment = par_taxons.get(taxons)
+        if fragment is None:
+            fragment = par_taxons[taxons] = serialiser(tableau_pollens(taxons))
+        return fragment
+
+    # Fonction appelée par le snapshot à la fin de chaque rafraîchissement
+    def rafraichir(self, snapshot):
+        date, table = snapshot.releves()
+        releves = [(code, releve) for code, releve in table.items() if releve.date == date]
+        par_taxons = {}
+        par_commune = {}
+        with metriques.mesurer('prerendu_fragments'):
+            for code_insee, releve in releves:
+                par_commune[code_insee] = (date, self._fragment(par_taxons, tuple(map(tuple, releve.taxons))))
+        with self.verrou:
+            self.par_taxons = par_taxons
+            self.par_commune = par_commune
+
+    # Fonction pour lire la taille du prérendu (jauges) : fragments distincts et communes servies
+    def taille(self):
+        with self.verrou:
+            return {'fragments': len(self.par_taxons), 'communes': len(self.par_commune)}
+
+    # Fonction pour obtenir le tableau d'une commune à partir de son relevé (dictionnaire du dcc.Store)
+    # Un relevé absent du prérendu (récupéré à la volée) est construit une fois puis gardé
+    def obtenir(self, code_insee, releve):
+        with self.verrou:
+            entree = self.par_commune.get(code_insee)
+            if entree is not None and entree[0] == releve['date']:
+                self.statistiques['succes'] += 1
+                return entree[1]
+            self.statistiques['echecs'] += 1
+            par_taxons = self.par_taxons
+        fragment = self._fragment(par_taxons, tuple(map(tuple, releve['taxons'])))
+        with self.verrou:
+            if self.par_taxons is par_taxons:
+                self.par_commune[code_insee] = (releve['date'], fragment)
+        return fragment
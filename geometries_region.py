@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# Géométries simplifiées de la région, préparées une fois pour toutes
+# Les contours des départements (fichier national departements.geojson, ~1 Mo) et des communes
+# (communes-hauts-de-france.geojson) sont découpés sur la région puis simplifiés à plusieurs
+# tolérances, une par plage de niveaux de zoom, avec des coordonnées arrondies (5 décimales
+# pour le zoom commune, 4 au-delà). La simplification se fait sur les frontières partagées :
+# chaque limite entre deux communes est simplifiée une seule fois, puis les polygones sont
+# reconstruits, ce qui évite les trous et les chevauchements entre voisines. Les frontières
+# sont découpées une seule fois pour tous les niveaux. Les fichiers produits dans geometries/
+# (géométries en WKB, relues sans analyse JSON) sont reconstruits quand leur source est plus récente.
+#
+# Utilisation : python geometries_region.py (construit tous les niveaux et affiche leur taille)
+# Réglages : POLLEN_GEOMETRIES = dossier des fichiers produits, POLLEN_CONTOURS = fichier des communes
+import os
+import pickle
+import threading
+from contextlib import contextmanager
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.ops import linemerge, polygonize, unary_union
+from shapely.strtree import STRtree
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DOSSIER_SOURCES = os.path.dirname(os.path.abspath(__file__))
+DOSSIER = os.environ.get('POLLEN_GEOMETRIES', os.path.join(DOSSIER_SOURCES, 'geometries'))
+SOURCES = {
+    'departements': os.path.join(DOSSIER_SOURCES, 'departements.geojson'),
+    # Fichier téléchargé au premier lancement (contours_communes.py)
+    'communes': os.environ.get('POLLEN_CONTOURS', os.path.join(DOSSIER_SOURCES, 'communes-hauts-de-france.geojson')),
+}
+DEPARTEMENTS_HDF = ['02', '59', '60', '62', '80']
+# Version des fichiers produits : à incrémenter quand la préparation change
+VERSION = 2
+
+# Niveaux de simplification selon le zoom minimal de la carte : (zoom minimal, tolérance en degrés, décimales)
+# environ 10 m pour une commune, 50 m pour un département, 200 m pour la vue régionale
+NIVEAUX = [
+    (11, 0.0001, 5),
+    (9, 0.0005, 4),
+    (0, 0.002, 4),
+]
+
+_verrou = threading.Lock()
+
+
+# Verrou de la construction des niveaux, partagé par les threads du processus et, avec fcntl, par les
+# workers : un seul construit les fichiers, les autres attendent puis les relisent
+# (sans fcntl, sous Windows, chaque processus peut faire sa propre construction)
+@contextmanager
+def _verrou_construction():
+    with _verrou:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(DOSSIER, exist_ok=True)
+        with open(os.path.join(DOSSIER, '.construction.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# Fonction pour choisir la tolérance de simplification adaptée à un niveau de zoom
+def tolerance_pour_zoom(zoom):
+    for zoom_min, tolerance, _ in NIVEAUX:
+        if zoom >= zoom_min:
+            return tolerance
+    return NIVEAUX[-1][1]
+
+
+def chemin(nom, tolerance):
+    return os.path.join(DOSSIER, f"{nom}_{tolerance}_v{VERSION}.pkl")
+
+
+# Fonction pour lire une source, réduite aux colonnes utiles et aux départements de la région
+def lire_source(nom, source):
+    geometries = gpd.read_file(source)[['code', 'nom', 'geometry']]
+    if nom == 'departements':
+        geometries = geometries[geometries['code'].isin(DEPARTEMENTS_HDF)]
+    return geometries.reset_index(drop=True)
+
+
+# Fonction pour découper les frontières de polygones voisins en arcs entre deux jonctions
+# (l'étape la plus coûteuse, faite une seule fois pour tous les niveaux de simplification)
+def decouper_arcs(geometries):
+    arcs = linemerge(unary_union([geometrie.boundary for geometrie in geometries]))
+    return list(getattr(arcs, 'geoms', [arcs]))
+
+
+# Fonction pour simplifier des polygones voisins sans créer de trous ni de chevauchements :
+# chaque arc est simplifié et arrondi une seule fois, puis les faces reconstruites sont rendues
+# aux polygones d'origine qui les contiennent
+def simplifier_couverture(geometries, arcs, arbre, tolerance, decimales):
+    grille = 10 ** -decimales
+    simplifies = [shapely.set_precision(arc.simplify(tolerance, preserve_topology=True), grille) for arc in arcs]
+    reseau = unary_union([arc for arc in simplifies if not arc.is_empty])
+    faces = {}
+    for face in polygonize(reseau):
+        # Les faces hors de tout polygone (trous entre départements, mer) sont écartées
+        for i in arbre.query(face.representative_point(), predicate='intersects'):
+            faces.setdefault(int(i), []).append(face)
+            break
+    resultat = []
+    for i, geometrie in enumerate(geometries):
+        if i in faces:
+            resultat.append(faces[i][0] if len(faces[i]) == 1 else unary_union(faces[i]))
+        else:
+            # Polygone trop petit pour garder une face : simplifié seul
+            resultat.append(shapely.set_precision(geometrie.simplify(tolerance, preserve_topology=True), grille))
+    # Coordonnées ramenées au nombre de décimales exact (la grille laisse des restes de calcul flottant)
+    return shapely.transform(np.array(resultat, dtype=object), lambda coordonnees: np.round(coordonnees, decimales))
+
+
+# Fonction pour écrire un niveau (codes, noms et géométries en WKB) de façon atomique
+def ecrire_niveau(geometries, destination):
+    niveau = {
+        'code': list(geometries['code']),
+        'nom': list(geometries['nom']),
+        'wkb': shapely.to_wkb(np.asarray(geometries.geometry)),
+    }
+    # Fichier temporaire propre au processus et au thread
+    temporaire = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporaire, 'wb') as f:
+        pickle.dump(niveau, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporaire, destination)
+
+
+# Fonction pour produire tous les niveaux de simplification d'une source
+def construire(nom, source=None):
+    source = source or SOURCES[nom]
+    originales = lire_source(nom, source)
+    geometries = list(originales.geometry)
+    arcs = decouper_arcs(geometries)
+    arbre = STRtree(geometries)
+    os.makedirs(DOSSIER, exist_ok=True)
+    for _, tolerance, decimales in NIVEAUX:
+        simplifiees = originales.copy()
+        simplifiees['geometry'] = simplifier_couverture(geometries, arcs, arbre, tolerance, decimales)
+        ecrire_niveau(simplifiees, chemin(nom, tolerance))
+
+
+def _a_jour(nom, source):
+    try:
+        date_source = os.path.getmtime(source)
+        return all(os.path.getmtime(chemin(nom, tolerance)) >= date_source for _, tolerance, _ in NIVEAUX)
+    except OSError:
+        return False
+
+
+# Fonction pour lire un niveau de simplification (GeoDataFrame code, nom, geometry), construit si besoin
+def charger(nom, tolerance, source=None):
+    source = source or SOURCES[nom]
+    if not _a_jour(nom, source):
+        with _verrou_construction():
+            # Un autre worker a pu les construire pendant l'attente du verrou
+            if not _a_jour(nom, source):
+                construire(nom, source)
+    with open(chemin(nom, tolerance), 'rb') as f:
+        niveau = pickle.load(f)
+    return gpd.GeoDataFrame({'code': niveau['code'], 'nom': niveau['nom']},
+                            geometry=shapely.from_wkb(niveau['wkb']), crs='EPSG:4326')
+
+
+if __name__ == '__main__':
+    for nom, source in SOURCES.items():
+        if not os.path.exists(source):
+            print("Source absente :", source)
+            continue
+        construire(nom, source)
+        print(f"{nom} : {os.path.getsize(source) / 1024:.0f} Ko au départ")
+        for zoom_min, tolerance, decimales in NIVEAUX:
+            niveau = charger(nom, tolerance, source)
+            print(f"  zoom {zoom_min}+ (tolérance {tolerance}, {decimales} décimales) : "
+                  f"{shapely.get_num_coordinates(np.asarray(niveau.geometry)).sum()} sommets, "
+                  f"{len(niveau.to_json(drop_id=True, separators=(',', ':'))) / 1024:.0f} Ko en GeoJSON")
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Historique des relevés polliniques
+# Chaque rafraîchissement du snapshot régional est recopié dans une base SQLite locale :
+# une ligne par commune et par jour pour l'indice global, une ligne par commune, taxon et
+# jour pour les catégories de risque. Les requêtes « commune X, taxons Y, entre les dates
+# A et B » passent par la clé primaire (code INSEE, taxon, date) et sont servies en local
+# sans aucune requête vers atmo-hdf.fr.
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+FICHIER = os.environ.get('POLLEN_HISTORIQUE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'historique_pollens.sqlite'))
+
+# Catégories de risque converties en niveau numérique pour tracer les courbes
+NIVEAUX = {
+    'Nul': 0,
+    'Faible': 1,
+    'Moyen': 2,
+    'Élevé': 3,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS releves (
+    code_insee TEXT NOT NULL,
+    date TEXT NOT NULL,
+    indice INTEGER,
+    couleur TEXT,
+    departement TEXT,
+    PRIMARY KEY (code_insee, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS taxons (
+    code_insee TEXT NOT NULL,
+    taxon TEXT NOT NULL,
+    date TEXT NOT NULL,
+    categorie TEXT,
+    niveau INTEGER,
+    PRIMARY KEY (code_insee, taxon, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS taxons_date ON taxons (date);
+"""
+
+
+class HistoriquePollen:
+    def __init__(self, chemin=FICHIER):
+        self.chemin = chemin
+        # Les écritures viennent du seul thread du snapshot, mais plusieurs workers peuvent partager le fichier
+        self.verrou = threading.Lock()
+        with self._connexion() as connexion:
+            connexion.execute('PRAGMA journal_mode=WAL')
+            connexion.executescript(SCHEMA)
+
+    # Une connexion par opération : sqlite3 interdit de partager une connexion entre threads
+    @contextmanager
+    def _connexion(self):
+        connexion = sqlite3.connect(self.chemin, timeout=30)
+        try:
+            with connexion:
+                yield connexion
+        finally:
+            connexion.close()
+
+    # Fonction pour enregistrer les relevés d'une journée (un relevé déjà présent est remplacé)
+    def enregistrer(self, releves_par_insee):
+        lignes_releves = []
+        lignes_taxons = []
+        for code_insee, releve in releves_par_insee.items():
+            lignes_releves.append((code_insee, releve.date, releve.indice, releve.couleur, releve.departement))
+            for taxon, categorie in releve.taxons:
+                lignes_taxons.append((code_insee, taxon, releve.date, categorie, NIVEAUX.get(categorie)))
+        with self.verrou, self._connexion() as connexion:
+            connexion.executemany('INSERT OR REPLACE INTO releves VALUES (?, ?, ?, ?, ?)', lignes_releves)
+            connexion.executemany('INSERT OR REPLACE INTO taxons VALUES (?, ?, ?, ?, ?)', lignes_taxons)
+        return len(lignes_releves)
+
+    # Fonction appelée par le snapshot à la fin de chaque rafraîchissement
+    def enregistrer_snapshot(self, snapshot):
+        date, table = snapshot.releves()
+        releves = {code: releve for code, releve in table.items() if releve.date == date}
+        self.enregistrer(releves)
+
+    # Fonction pour lire l'évolution des taxons d'une commune entre deux dates (incluses, au format AAAA-MM-JJ)
+    # Renvoie une liste de (date, taxon, catégorie, niveau) triée par taxon puis par date
+    def serie_taxons(self, code_insee, debut, fin, taxons=None):
+        requete = 'SELECT date, taxon, categorie, niveau FROM taxons WHERE code_insee = ? AND date BETWEEN ? AND ?'
+        parametres = [code_insee, debut, fin]
+        if taxons:
+            requete += ' AND taxon IN ({})'.format(', '.join('?' * len(taxons)))
+            parametres.extend(taxons)
+        requete += ' ORDER BY taxon, date'
+        with self._connexion() as connexion:
+            return connexion.execute(requete, parametres).fetchall()
+
+    # Fonction pour lire l'évolution de l'indice global d'une commune entre deux dates
+    def serie_indice(self, code_insee, debut, fin):
+        with self._connexion() as connexion:
+            return connexion.execute(
+                'SELECT date, indice, couleur FROM releves WHERE code_insee = ? AND date BETWEEN ? AND ? ORDER BY date',
+                (code_insee, debut, fin)).fetchall()
+
+    # Fonction pour lister les taxons connus d'une commune
+    def taxons(self, code_insee):
+        with self._connexion() as connexion:
+            return [ligne[0] for ligne in connexion.execute(
+                'SELECT DISTINCT taxon FROM taxons WHERE code_insee = ? ORDER BY taxon', (code_insee,))]
+
+    # Fonction pour connaître la plage de dates disponible (None, None si l'historique est vide)
+    def bornes(self):
+        with self._connexion() as connexion:
+            return connexion.execute('SELECT MIN(date), MAX(date) FROM releves').fetchone()
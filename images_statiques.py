@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Images statiques du tableau de bord (calendrier pollinique, échelle des pollens, capteur)
+# Les images sont téléchargées une seule fois depuis atmo-hdf.fr et enregistrées dans le
+# dossier assets/ de Dash, qui les sert comme fichiers statiques. Les onglets n'embarquent
+# plus qu'une URL au lieu de l'image encodée en base64. Un thread de fond vérifie les images
+# chaque jour et ne réécrit les fichiers que si leur empreinte SHA-256 a changé.
+import hashlib
+import os
+import threading
+import time
+from io import BytesIO
+
+import requests
+from dash import html
+
+import metriques
+from cache_http import cache
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+IMAGES = {
+    'calendrier_pollens': "https://www.atmo-hdf.fr/sites/hdf/files/styles/large_w1500/public/medias/images/2023-08/Calendrier_pollens_Hauts-de-France.jpg",
+    'echelle_pollens': "https://www.atmo-hdf.fr/sites/hdf/files/medias/images/2022-03/echelle_pollens_2022.jpg",
+    'capteur_pollens': "https://www.atmo-hdf.fr/sites/hdf/files/medias/images/2022-09/capteur_pollens_info.jpg",
+}
+DOSSIER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'images')
+URL_ASSETS = '/assets/images/'
+# Largeur des variantes réduites pour les écrans de téléphone
+LARGEUR_REDUITE = 800
+INTERVALLE_RAFRAICHISSEMENT = 24 * 3600
+# Durée de cache navigateur des fichiers de assets/ : l'empreinte dans l'URL force le rechargement si l'image change
+DUREE_CACHE_NAVIGATEUR = 365 * 24 * 3600
+
+# Empreinte et dimensions de chaque image déjà enregistrée
+empreintes = {}
+largeurs = {}
+verrou = threading.Lock()
+
+
+# Fonction pour enregistrer un fichier de façon atomique (pas de lecture d'un fichier à moitié écrit),
+# avec un fichier temporaire propre au processus et au thread (les workers écrivent les mêmes images)
+def ecrire_fichier(chemin, contenu):
+    temporaire = f"{chemin}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporaire, 'wb') as f:
+        f.write(contenu)
+    os.replace(temporaire, chemin)
+
+
+# Fonction pour produire les variantes WebP (taille d'origine et taille réduite) d'une image
+def creer_variantes(nom, contenu):
+    if Image is None:
+        return None
+    image = Image.open(BytesIO(contenu))
+    image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    image.save(os.path.join(DOSSIER, nom + '.webp'), 'WEBP', quality=80)
+    if image.width > LARGEUR_REDUITE:
+        hauteur = round(image.height * LARGEUR_REDUITE / image.width)
+        reduite = image.resize((LARGEUR_REDUITE, hauteur), Image.LANCZOS)
+        reduite.save(os.path.join(DOSSIER, f"{nom}_{LARGEUR_REDUITE}.webp"), 'WEBP', quality=80)
+    return image.width
+
+
+# Fonction pour télécharger une image et mettre à jour les fichiers si elle a changé
+@metriques.chronometrer('image_statique')
+def rafraichir_image(nom):
+    response = cache.get(IMAGES[nom])
+    if response.status_code != 200:
+        print(f"Impossible de télécharger l'image {nom} : code {response.status_code}")
+        return False
+    empreinte = hashlib.sha256(response.content).hexdigest()
+    chemin = os.path.join(DOSSIER, nom + '.jpg')
+    if empreinte == empreintes.get(nom) and os.path.exists(chemin):
+        return False
+    os.makedirs(DOSSIER, exist_ok=True)
+    ecrire_fichier(chemin, response.content)
+    try:
+        largeur = creer_variantes(nom, response.content)
+    except (OSError, ValueError) as e:
+        print(f"Impossible de créer les variantes WebP de {nom} :", e)
+        largeur = None
+    with verrou:
+        empreintes[nom] = empreinte
+        largeurs[nom] = largeur
+    return True
+
+
+# Fonction pour rafraîchir toutes les images
+def rafraichir_images():
+    for nom in IMAGES:
+        try:
+            rafraichir_image(nom)
+        except requests.RequestException as e:
+            print(f"Échec du rafraîchissement de l'image {nom} :", e)
+
+
+def _boucle():
+    while True:
+        rafraichir_images()
+        time.sleep(INTERVALLE_RAFRAICHISSEMENT)
+
+
+# Fonction pour reprendre les images déjà présentes sur disque (redémarrage de l'application)
+def charger_images_existantes():
+    for nom in IMAGES:
+        chemin = os.path.join(DOSSIER, nom + '.jpg')
+        if not os.path.exists(chemin):
+            continue
+        with open(chemin, 'rb') as f:
+            contenu = f.read()
+        largeur = None
+        if Image is not None and os.path.exists(os.path.join(DOSSIER, nom + '.webp')):
+            with Image.open(chemin) as image:
+                largeur = image.width
+        with verrou:
+            empreintes[nom] = hashlib.sha256(contenu).hexdigest()
+            largeurs[nom] = largeur
+
+
+# Fonction pour lancer le téléchargement et le rafraîchissement périodique en tâche de fond
+def demarrer(app):
+    # Les fichiers de assets/ sont servis par Flask : on allonge leur durée de cache
+    app.server.config['SEND_FILE_MAX_AGE_DEFAULT'] = DUREE_CACHE_NAVIGATEUR
+    charger_images_existantes()
+    threading.Thread(target=_boucle, name='images-statiques', daemon=True).start()
+
+
+# Fonction pour construire le composant image d'un onglet
+# Tant que l'image n'a pas encore été téléchargée, on pointe directement vers atmo-hdf.fr
+def composant_image(nom, style):
+    with verrou:
+        empreinte = empreintes.get(nom)
+        largeur = largeurs.get(nom)
+    if empreinte is None:
+        return html.Img(src=IMAGES[nom], style=style)
+    version = empreinte[:12]
+    image = html.Img(src=f"{URL_ASSETS}{nom}.jpg?v={version}", style=style)
+    if largeur is None:
+        return image
+    sources = f"{URL_ASSETS}{nom}.webp?v={version} {largeur}w"
+    if largeur > LARGEUR_REDUITE:
+        sources = f"{URL_ASSETS}{nom}_{LARGEUR_REDUITE}.webp?v={version} {LARGEUR_REDUITE}w, " + sources
+    return html.Picture([html.Source(srcSet=sources, type='image/webp'), image])
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+# Index des communes des Hauts-de-France
+# Construit une seule fois au démarrage à partir du DataFrame des communes, il remplace
+# les comparaisons de chaînes sur toute la colonne 'nom_commune_postal' par des accès
+# directs à un dictionnaire. Les clés sont insensibles à la casse, aux accents, aux tirets
+# et aux apostrophes ; un index de trigrammes permet de proposer des communes proches
+# quand la saisie contient une faute de frappe.
+import bisect
+import re
+import unicodedata
+from collections import namedtuple
+
+Commune = namedtuple('Commune', ['nom', 'code_insee', 'code_postal', 'latitude', 'longitude', 'departement'])
+
+# Abréviations utilisées dans les noms de communes du fichier (ST, STE...)
+ABREVIATIONS = {
+    'saint': 'st',
+    'sainte': 'ste',
+}
+
+
+# Fonction pour normaliser un nom de commune : minuscules, sans accents ni ponctuation
+def normaliser(nom):
+    nom = unicodedata.normalize('NFKD', str(nom))
+    nom = ''.join(c for c in nom if not unicodedata.combining(c)).lower()
+    mots = re.findall(r'[a-z0-9]+', nom)
+    return ' '.join(ABREVIATIONS.get(mot, mot) for mot in mots)
+
+
+# Fonction pour découper une clé en trigrammes (les espaces sont ignorés)
+def trigrammes(cle):
+    cle = '  ' + cle.replace(' ', '') + ' '
+    return {cle[i:i + 3] for i in range(len(cle) - 2)}
+
+
+class IndexCommunes:
+    def __init__(self, data):
+        self.par_insee = {}
+        self.par_nom = {}
+        for row in data.drop_duplicates('code_commune_INSEE').itertuples(index=False):
+            commune = Commune(
+                nom=row.nom_commune_postal,
+                code_insee=row.code_commune_INSEE,
+                code_postal=row.code_postal,
+                latitude=float(row.latitude),
+                longitude=float(row.longitude),
+                departement=row.nom_departement,
+            )
+            self.par_insee[commune.code_insee] = commune
+            # Plusieurs communes de départements différents peuvent porter le même nom
+            self.par_nom.setdefault(normaliser(commune.nom), []).append(commune)
+
+        # Clés triées pour la recherche par préfixe
+        self.cles = sorted(self.par_nom)
+        # Index de trigrammes pour la recherche approchée
+        self.par_trigramme = {}
+        for cle in self.cles:
+            for trigramme in trigrammes(cle):
+                self.par_trigramme.setdefault(trigramme, []).append(cle)
+
+        # Options du menu déroulant, calculées une seule fois : la valeur est le code INSEE,
+        # le département est ajouté au libellé quand le nom existe dans plusieurs départements
+        self.options = []
+        self.option_par_insee = {}
+        for cle in self.cles:
+            communes = self.par_nom[cle]
+            for commune in communes:
+                label = commune.nom
+                if len(communes) > 1:
+                    label = f"{commune.nom} ({commune.departement}, {commune.code_postal})"
+                option = {'label': label, 'value': commune.code_insee}
+                self.options.append(option)
+                self.option_par_insee[commune.code_insee] = option
+
+    # Fonction pour retrouver les communes correspondant à un code INSEE ou à un nom
+    def resoudre(self, valeur):
+        if not valeur:
+            return []
+        valeur = str(valeur).strip()
+        if valeur in self.par_insee:
+            return [self.par_insee[valeur]]
+        return list(self.par_nom.get(normaliser(valeur), []))
+
+    # Fonction pour lister les communes dont le nom commence par le texte saisi
+    def prefixe(self, texte, limite=20):
+        debut = normaliser(texte)
+        resultats = []
+        i = bisect.bisect_left(self.cles, debut)
+        while i < len(self.cles) and self.cles[i].startswith(debut) and len(resultats) < limite:
+            resultats.extend(self.par_nom[self.cles[i]])
+            i += 1
+        return resultats[:limite]
+
+    # Fonction pour renvoyer les options du menu déroulant correspondant à une saisie
+    # (recherche par préfixe, puis recherche approchée si aucun nom ne commence par la saisie)
+    def options_pour(self, texte, limite=20):
+        communes = self.prefixe(texte, limite)
+        if not communes:
+            communes = self.suggerer(texte, limite)
+        return [self.option_par_insee[commune.code_insee] for commune in communes]
+
+    # Fonction pour proposer les communes les plus proches d'une saisie ("vouliez-vous dire")
+    def suggerer(self, texte, limite=5, score_min=0.3):
+        cle = normaliser(texte)
+        if not cle:
+            return []
+        trigrammes_saisie = trigrammes(cle)
+        communs = {}
+        for trigramme in trigrammes_saisie:
+            for candidat in self.par_trigramme.get(trigramme, []):
+                communs[candidat] = communs.get(candidat, 0) + 1
+        scores = []
+        for candidat, nombre in communs.items():
+            # Indice de Jaccard entre les trigrammes de la saisie et ceux du candidat
+            score = nombre / (len(trigrammes_saisie) + len(trigrammes(candidat)) - nombre)
+            if score >= score_min:
+                scores.append((score, candidat))
+        scores.sort(key=lambda x: (-x[0], x[1]))
+        resultats = []
+        for _, candidat in scores[:limite]:
+            resultats.extend(self.par_nom[candidat])
+        return resultats[:limite]
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+# Mesures de performance du tableau de bord
+# Les étapes coûteuses (téléchargements vers l'extérieur, analyse BeautifulSoup, recherche
+# des communes, rendu folium...) sont chronométrées dans des histogrammes, les événements
+# (réponses par hôte, erreurs) sont comptés, et les statistiques déjà tenues par les caches
+# et le snapshot sont relues au moment de l'export. Le tout est servi au format texte de
+# Prometheus sur la route /metrics du serveur Flask de Dash.
+# Les mesures sont désactivées avec POLLEN_METRIQUES=0 : mesurer() renvoie alors un contexte
+# vide, chronometrer() rend la fonction telle quelle et la route n'est pas déclarée.
+# Les valeurs sont propres à chaque processus : avec plusieurs workers, chacun expose les siennes.
+import functools
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+ACTIF = os.environ.get('POLLEN_METRIQUES', '1') != '0'
+CHEMIN = '/metrics'
+# Bornes des histogrammes de durée, en secondes
+BORNES = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+NOM_DUREES = 'pollen_duree_secondes'
+NOM_EVENEMENTS = 'pollen_evenements_total'
+TYPE_CONTENU = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogrammes : étiquettes triées -> [nombre par borne, somme, nombre]
+durees = {}
+# Compteurs : (nom, étiquettes triées) -> valeur
+compteurs = {}
+# Valeurs relues à chaque export : (nom, type, aide, fonction renvoyant [(étiquettes, valeur)])
+collecteurs = []
+verrou = threading.Lock()
+_VIDE = nullcontext()
+
+
+# Chronomètre d'une étape, utilisé comme contexte : with mesurer('rendu_folium'): ...
+class Chrono:
+    __slots__ = ('etiquettes', 'debut')
+
+    def __init__(self, etiquettes):
+        self.etiquettes = etiquettes
+        self.debut = 0.0
+
+    def __enter__(self):
+        self.debut = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observer(self.etiquettes, time.perf_counter() - self.debut)
+        return False
+
+
+# Fonction pour ajouter une durée à l'histogramme d'une étape
+def observer(etiquettes, duree):
+    with verrou:
+        serie = durees.get(etiquettes)
+        if serie is None:
+            serie = durees[etiquettes] = [[0] * len(BORNES), 0.0, 0]
+        for i, borne in enumerate(BORNES):
+            if duree <= borne:
+                serie[0][i] += 1
+                break
+        serie[1] += duree
+        serie[2] += 1
+
+
+# Fonction pour chronométrer un bloc de code (contexte vide si les mesures sont désactivées)
+def mesurer(etape, **etiquettes):
+    if not ACTIF:
+        return _VIDE
+    etiquettes['etape'] = etape
+    return Chrono(tuple(sorted(etiquettes.items())))
+
+
+# Décorateur pour chronométrer une fonction entière (un callback Dash par exemple)
+def chronometrer(etape):
+    def decorateur(fonction):
+        if not ACTIF:
+            return fonction
+        etiquettes = (('etape', etape),)
+
+        @functools.wraps(fonction)
+        def enveloppe(*args, **kwargs):
+            with Chrono(etiquettes):
+                return fonction(*args, **kwargs)
+        return enveloppe
+    return decorateur
+
+
+# Fonction pour compter un événement
+def compter(evenement, valeur=1, **etiquettes):
+    if not ACTIF:
+        return
+    etiquettes['evenement'] = evenement
+    cle = tuple(sorted(etiquettes.items()))
+    with verrou:
+        compteurs[cle] = compteurs.get(cle, 0) + valeur
+
+
+# Fonction pour exporter un dictionnaire de statistiques tenu ailleurs (cache, snapshot...)
+# Chaque clé numérique devient une valeur de la métrique, avec l'étiquette donnée
+def suivre(nom, aide, fonction, etiquette='resultat', type_metrique='counter'):
+    def lire():
+        return [({etiquette: cle}, valeur) for cle, valeur in fonction().items()
+                if isinstance(valeur, (int, float)) and not isinstance(valeur, bool)]
+    collecteurs.append((nom, type_metrique, aide, lire))
+
+
+def _echapper(valeur):
+    return str(valeur).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _etiquettes(etiquettes):
+    if not etiquettes:
+        return ''
+    return '{' + ','.join(f'{cle}="{_echapper(valeur)}"' for cle, valeur in etiquettes) + '}'
+
+
+# Fonction pour produire le texte au format d'exposition Prometheus
+def exporter():
+    with verrou:
+        copie_durees = {cle: (list(serie[0]), serie[1], serie[2]) for cle, serie in durees.items()}
+        copie_compteurs = dict(compteurs)
+    lignes = [f"# HELP {NOM_DUREES} Durée des étapes du tableau de bord",
+              f"# TYPE {NOM_DUREES} histogram"]
+    for cle, (nombres, somme, nombre) in sorted(copie_durees.items()):
+        cumul = 0
+        for borne, compte in zip(BORNES, nombres):
+            cumul += compte
+            lignes.append(f"{NOM_DUREES}_bucket{_etiquettes(cle + (('le', repr(borne)),))} {cumul}")
+        lignes.append(f"{NOM_DUREES}_bucket{_etiquettes(cle + (('le', '+Inf'),))} {nombre}")
+        lignes.append(f"{NOM_DUREES}_sum{_etiquettes(cle)} {somme!r}")
+        lignes.append(f"{NOM_DUREES}_count{_etiquettes(cle)} {nombre}")
+    lignes.append(f"# HELP {NOM_EVENEMENTS} Événements comptés par le tableau de bord")
+    lignes.append(f"# TYPE {NOM_EVENEMENTS} counter")
+    for cle, valeur in sorted(copie_compteurs.items()):
+        lignes.append(f"{NOM_EVENEMENTS}{_etiquettes(cle)} {valeur}")
+    for nom, type_metrique, aide, lire in collecteurs:
+        try:
+            valeurs = lire()
+        except Exception as e:
+            print(f"Impossible de lire la métrique {nom} :", e)
+            continue
+        lignes.append(f"# HELP {nom} {aide}")
+        lignes.append(f"# TYPE {nom} {type_metrique}")
+        for etiquettes, valeur in valeurs:
+            lignes.append(f"{nom}{_etiquettes(sorted(etiquettes.items()))} {valeur}")
+    return '\n'.join(lignes) + '\n'
+
+
+# Fonction pour déclarer la route /metrics sur le serveur Flask de l'application Dash
+def exposer(app, chemin=CHEMIN):
+    if not ACTIF:
+        return
+
+    def metrics():
+        return exporter(), 200, {'Content-Type': TYPE_CONTENU}
+    app.server.add_url_rule(chemin, 'metriques', metrics)
+
+
+# Dans un processus fils créé par fork, le verrou a pu être pris par un thread du parent
+def _apres_fork():
+    global verrou
+    verrou = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_apres_fork)
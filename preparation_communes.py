@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Préparation de la table des communes des Hauts-de-France
+# Le fichier national communes-departement-region.csv est lu par morceaux (mémoire bornée,
+# seules les colonnes utiles sont lues, avec leur type), filtré sur la région, puis les codes
+# postaux et INSEE sont complétés sur 5 caractères en une opération vectorisée. Le résultat
+# est écrit une seule fois dans villes_hauts_de_france_modifie.csv, que l'application charge
+# directement (demarrage.py). L'empreinte SHA-256 du fichier source est conservée : tant
+# qu'elle ne change pas et que le fichier préparé existe, la préparation n'est pas refaite.
+#
+# Utilisation : python preparation_communes.py [fichier source] [--forcer]
+import hashlib
+import json
+import os
+import sys
+
+import pandas as pd
+
+DOSSIER = os.path.dirname(os.path.abspath(__file__))
+FICHIER_SOURCE = os.path.join(DOSSIER, 'communes-departement-region.csv')
+FICHIER_VILLES = os.path.join(DOSSIER, 'villes_hauts_de_france_modifie.csv')
+FICHIER_ETAT = os.path.join(os.environ.get('POLLEN_CACHE_DEMARRAGE', os.path.join(DOSSIER, '.cache_demarrage')),
+                            'preparation_communes.json')
+REGION = "Hauts-de-France"
+# Version de la préparation : à incrémenter quand le format du fichier préparé change
+VERSION = 1
+LIGNES_PAR_MORCEAU = 50000
+TAILLE_BLOC = 1024 * 1024
+
+COLONNES = ['nom_commune_postal', 'latitude', 'longitude', 'code_postal', 'code_commune_INSEE', 'nom_departement']
+TYPES = {
+    'nom_commune_postal': str,
+    'latitude': 'float64',
+    'longitude': 'float64',
+    'code_postal': str,
+    'code_commune_INSEE': str,
+    'nom_departement': str,
+    'nom_region': str,
+}
+
+
+# Fonction pour calculer l'empreinte d'un fichier sans le charger entièrement en mémoire
+def empreinte(chemin):
+    sha = hashlib.sha256()
+    with open(chemin, 'rb') as f:
+        for bloc in iter(lambda: f.read(TAILLE_BLOC), b''):
+            sha.update(bloc)
+    return sha.hexdigest()
+
+
+def lire_etat(chemin=FICHIER_ETAT):
+    try:
+        with open(chemin, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def ecrire_etat(etat, chemin=FICHIER_ETAT):
+    os.makedirs(os.path.dirname(chemin), exist_ok=True)
+    temporaire = chemin + '.tmp'
+    with open(temporaire, 'w', encoding='utf-8') as f:
+        json.dump(etat, f)
+    os.replace(temporaire, chemin)
+
+
+# Fonction pour filtrer le fichier national morceau par morceau
+def lire_region(source, region=REGION, lignes_par_morceau=LIGNES_PAR_MORCEAU):
+    morceaux = []
+    for morceau in pd.read_csv(source, usecols=COLONNES + ['nom_region'], dtype=TYPES, chunksize=lignes_par_morceau):
+        morceaux.append(morceau.loc[morceau['nom_region'] == region, COLONNES])
+    return pd.concat(morceaux, ignore_index=True)
+
+
+# Fonction pour produire la table préparée : codes complétés sur 5 caractères et colonne
+# 'nom_département' (copie de 'nom_departement', attendue par les anciennes versions du fichier)
+def preparer_table(data):
+    data['code_postal'] = data['code_postal'].str.zfill(5)
+    data['code_commune_INSEE'] = data['code_commune_INSEE'].str.zfill(5)
+    data['nom_département'] = data['nom_departement']
+    return data
+
+
+# Fonction pour préparer le fichier des communes si la source a changé depuis la dernière fois
+# Renvoie True si le fichier préparé a été réécrit
+def preparer(source=FICHIER_SOURCE, sortie=FICHIER_VILLES, forcer=False):
+    if not os.path.exists(source):
+        if not os.path.exists(sortie):
+            raise FileNotFoundError(f"Ni le fichier source {source} ni le fichier préparé {sortie} n'existent")
+        return False
+    empreinte_source = empreinte(source)
+    etat = {'source': empreinte_source, 'version': VERSION}
+    if not forcer and os.path.exists(sortie) and lire_etat() == etat:
+        return False
+    data = preparer_table(lire_region(source))
+    temporaire = sortie + '.tmp'
+    data.to_csv(temporaire, index=False)
+    os.replace(temporaire, sortie)
+    ecrire_etat(etat)
+    return True
+
+
+if __name__ == '__main__':
+    arguments = [argument for argument in sys.argv[1:] if argument != '--forcer']
+    if preparer(arguments[0] if arguments else FICHIER_SOURCE, forcer='--forcer' in sys.argv[1:]):
+        print("Fichier des communes préparé :", FICHIER_VILLES)
+    else:
+        print("Fichier des communes déjà à jour :", FICHIER_VILLES)
@@ -3,59 +3,19 @@ from dash import dcc, html, Input, Output
 import requests
 from bs4 import BeautifulSoup
 import pandas as pd
-import geopandas as gpd
 import folium
 from folium import plugins
 
+import geometries_region
+import preparation_communes
 
-# Charger les données du fichier "communes-departement-region.csv"
-donnees = pd.read_csv("communes-departement-region.csv", sep=",")
 
-# Sélectionner les lignes où la colonne "nom_region" vaut "Hauts-de-France"
-donnees_hdf = donnees[donnees['nom_region'] == "Hauts-de-France"]
+# Préparer le fichier des communes à partir de "communes-departement-region.csv"
+# (la préparation n'est refaite que si le fichier national a changé)
+preparation_communes.preparer()
 
-# Sélectionner uniquement les colonnes requises
-donnees_finales = donnees_hdf[['nom_commune_postal', 'latitude', 'longitude', 'code_postal', 'code_commune_INSEE', 'nom_departement']]
-
-# Ajouter le zéro devant les codes postaux à 4 chiffres
-donnees_finales['code_postal'] = donnees_finales['code_postal'].apply(lambda x: str(x).zfill(5))
-
-# Enregistrer les données dans un nouveau fichier CSV
-donnees_finales.to_csv("villes_hauts_de_france.csv", index=False)
-
-
-# Charger les données des villes des Hauts-de-France à partir du fichier CSV
-data = pd.read_csv("villes_hauts_de_france.csv")
-
-# Garder la colonne "nom_département" dans le DataFrame
-nom_departement = data['nom_departement']
-
-def ajouter_zero(code_postal):
-    if len(str(code_postal)) == 4:
-        return str(code_postal).zfill(5)  # Ajoute un zéro devant le code postal à 4 chiffres
-    else:
-        return str(code_postal)  # Retourne le code postal inchangé s'il a déjà 5 chiffres ou plus
-
-# Appliquer la fonction à la colonne 'code_postal'
-data['code_postal'] = data['code_postal'].apply(ajouter_zero)
-
-def ajouter_zero(code_INSEE):
-    return str(code_INSEE).zfill(5)  # Ajoute un zéro devant le code INSEE si nécessaire
-
-# Appliquer la fonction à la colonne 'code_commune_INSEE'
-data['code_commune_INSEE'] = data['code_commune_INSEE'].apply(ajouter_zero)
-
-# Ajouter la colonne "nom_département" au DataFrame modifié
-data['nom_département'] = nom_departement
-
-# Enregistrer le DataFrame modifié dans un nouveau fichier CSV
-data.to_csv("villes_hauts_de_france_modifie.csv", index=False)
-
-
-# Afficher les premières lignes du DataFrame modifié
-#print(data.head())
-
-data = pd.read_csv("villes_hauts_de_france_modifie.csv", dtype={'code_postal': str, 'code_commune_INSEE': str})
+# Charger les données des villes des Hauts-de-France préparées
+data = pd.read_csv(preparation_communes.FICHIER_VILLES, dtype={'code_postal': str, 'code_commune_INSEE': str})
 
 # Fonction pour ajuster les noms de communes en supprimant les espaces
 def ajuster_nom_commune(nom_commune):
@@ -73,12 +33,9 @@ def construire_url(nom_commune, code_commune_INSEE, code_postal):
     url = f"{base_url}{nom_commune}/{code_commune_INSEE}/pollen?adresse={nom_commune}+({code_postal})&date=2024-04-19"
     return url
 
-# Charger le fichier GeoJSON
-geojson_file = "departements.geojson"
-gdf = gpd.read_file(geojson_file)
-# Filtrer les départements d'intérêt
-departements_interet = ["Aisne", "Nord", "Pas-de-Calais", "Oise", "Somme"]
-gdf = gdf[gdf['nom'].isin(departements_interet)]
+# Charger les départements d'intérêt (Aisne, Nord, Pas-de-Calais, Oise, Somme), découpés et
+# simplifiés une fois à partir de "departements.geojson" pour le niveau de zoom de la carte
+gdf = geometries_region.charger('departements', geometries_region.tolerance_pour_zoom(8))
 # Créer la carte Folium
 map = folium.Map(location=[49.5, 2.5], zoom_start=8)
 # Ajouter les départements à la carte
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# Recherche des communes les plus proches d'une position GPS
+# Un arbre k-d (cKDTree de scipy) est construit une seule fois au démarrage sur les
+# coordonnées des communes de villes_hauts_de_france_modifie.csv, placées sur la sphère
+# unité en coordonnées cartésiennes. La distance en ligne droite entre deux points de la
+# sphère croît avec la distance haversine : les plus proches voisins sont donc les mêmes,
+# et la corde est reconvertie en distance sur la surface de la Terre. Une position envoyée
+# par le navigateur est résolue en quelques dizaines de microsecondes, et des milliers de
+# points sont résolus en un seul appel (traitements statistiques) sans boucle Python.
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Rayon moyen de la Terre, pour convertir les distances angulaires en kilomètres
+RAYON_TERRE_KM = 6371.0088
+
+
+# Fonction pour placer des points (en degrés) sur la sphère unité
+def vers_sphere(latitudes, longitudes):
+    latitudes = np.radians(np.asarray(latitudes, dtype='float64'))
+    longitudes = np.radians(np.asarray(longitudes, dtype='float64'))
+    cos_latitudes = np.cos(latitudes)
+    return np.column_stack([cos_latitudes * np.cos(longitudes), cos_latitudes * np.sin(longitudes), np.sin(latitudes)])
+
+
+# Fonction pour convertir une corde de la sphère unité en distance haversine (km)
+def corde_vers_km(cordes):
+    return 2 * RAYON_TERRE_KM * np.arcsin(np.minimum(np.asarray(cordes) / 2, 1.0))
+
+
+class ProximiteCommunes:
+    def __init__(self, data):
+        communes = data.drop_duplicates('code_commune_INSEE').dropna(subset=['latitude', 'longitude'])
+        self.codes = communes['code_commune_INSEE'].to_numpy(dtype=object)
+        self.arbre = cKDTree(vers_sphere(communes['latitude'], communes['longitude']))
+
+    # Fonction pour trouver les k communes les plus proches de chaque point d'un lot
+    # Renvoie deux tableaux (nombre de points, k) : codes INSEE et distances en kilomètres
+    def plus_proches_lot(self, latitudes, longitudes, k=1):
+        cordes, indices = self.arbre.query(vers_sphere(latitudes, longitudes), k=[i + 1 for i in range(min(k, len(self.codes)))])
+        return self.codes[indices], corde_vers_km(cordes)
+
+    # Fonction pour trouver les k communes les plus proches d'un point : liste de (code INSEE, distance en km)
+    def plus_proches(self, latitude, longitude, k=1):
+        latitude, longitude = math.radians(latitude), math.radians(longitude)
+        point = (math.cos(latitude) * math.cos(longitude), math.cos(latitude) * math.sin(longitude), math.sin(latitude))
+        cordes, indices = self.arbre.query(point, k=[i + 1 for i in range(min(k, len(self.codes)))])
+        return list(zip(self.codes[indices], corde_vers_km(cordes).tolist()))
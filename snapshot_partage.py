@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Snapshot pollinique partagé entre les workers d'un même serveur
+# Sous gunicorn, chaque worker a son propre snapshot en mémoire et ferait son propre crawl.
+# Le worker qui termine un rafraîchissement publie les relevés du jour dans un fichier binaire
+# à enregistrements de taille fixe (tableau structuré numpy, format .npy), trié par code INSEE.
+# Les autres workers projettent ce fichier en mémoire en lecture seule (mmap) : les pages sont
+# partagées par le système, la recherche d'une commune est une recherche dichotomique, et un
+# seul crawl par jour est lancé grâce à un verrou de fichier. Le fichier est remplacé de façon
+# atomique : un worker qui lit encore l'ancienne version la garde jusqu'à sa prochaine lecture.
+# Les workers doivent être lancés sans --preload : chaque worker démarre ses threads de fond
+# (snapshot, article, images, contours) en chargeant l'application, et des workers créés par
+# fork après ce chargement n'en auraient aucun.
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from snapshot_pollen import ReleveCommune
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DOSSIER = os.environ.get('POLLEN_PARTAGE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache_partage'))
+# Nombre maximal de taxons par commune (les pages en affichent six aujourd'hui)
+MAX_TAXONS = 12
+# Intervalle minimal entre deux vérifications du remplacement du fichier, en secondes
+INTERVALLE_VERIFICATION = 1.0
+
+TYPE_RELEVE = np.dtype([
+    ('code_insee', 'S5'),
+    ('date', 'S10'),
+    # -1 quand la page ne donne pas d'indice
+    ('indice', 'i1'),
+    ('couleur', 'S16'),
+    ('departement', 'S64'),
+    ('nombre_taxons', 'u1'),
+    ('taxons', 'S32', (MAX_TAXONS,)),
+    ('categories', 'S16', (MAX_TAXONS,)),
+])
+
+
+# Fonction pour encoder un texte dans un champ de taille fixe sans couper un caractère en deux
+def encoder(texte, taille):
+    if texte is None:
+        return b''
+    octets = texte.encode('utf-8')
+    if len(octets) > taille:
+        octets = octets[:taille].decode('utf-8', errors='ignore').encode('utf-8')
+    return octets
+
+
+def decoder(octets):
+    return octets.decode('utf-8') or None
+
+
+# Fonction pour convertir les relevés d'une journée en tableau structuré trié par code INSEE
+def vers_tableau(releves):
+    tableau = np.zeros(len(releves), dtype=TYPE_RELEVE)
+    for i, code_insee in enumerate(sorted(releves)):
+        releve = releves[code_insee]
+        taxons = releve.taxons[:MAX_TAXONS]
+        ligne = tableau[i]
+        ligne['code_insee'] = code_insee.encode('ascii')
+        ligne['date'] = releve.date.encode('ascii')
+        ligne['indice'] = -1 if releve.indice is None else releve.indice
+        ligne['couleur'] = encoder(releve.couleur, 16)
+        ligne['departement'] = encoder(releve.departement, 64)
+        ligne['nombre_taxons'] = len(taxons)
+        for j, (taxon, categorie) in enumerate(taxons):
+            ligne['taxons'][j] = encoder(taxon, 32)
+            ligne['categories'][j] = encoder(categorie, 16)
+    return tableau
+
+
+# Fonction pour reconstruire un relevé à partir d'un enregistrement
+def vers_releve(ligne):
+    nombre = int(ligne['nombre_taxons'])
+    indice = int(ligne['indice'])
+    return ReleveCommune(
+        taxons=[(decoder(ligne['taxons'][j]), decoder(ligne['categories'][j]) or '') for j in range(nombre)],
+        departement=decoder(ligne['departement']),
+        indice=None if indice < 0 else indice,
+        couleur=decoder(ligne['couleur']),
+        date=ligne['date'].decode('ascii'),
+    )
+
+
+class SnapshotPartage:
+    def __init__(self, dossier=DOSSIER):
+        self.dossier = dossier
+        self.chemin = os.path.join(dossier, 'snapshot.npy')
+        self.chemin_verrou = os.path.join(dossier, 'crawl.lock')
+        os.makedirs(dossier, exist_ok=True)
+        self.tableau = None
+        self.codes = None
+        self.identite = None
+        self.verifie_a = 0.0
+        self.verrou = threading.Lock()
+
+    # Fonction pour publier les relevés d'une journée (remplacement atomique du fichier)
+    def publier(self, releves):
+        temporaire = f"{self.chemin}.{os.getpid()}.tmp"
+        with open(temporaire, 'wb') as f:
+            np.save(f, vers_tableau(releves))
+        os.replace(temporaire, self.chemin)
+        self.verifie_a = 0.0
+
+    # Fonction pour obtenir le tableau projeté en mémoire, projeté à nouveau si le fichier a été remplacé
+    def _tableau(self):
+        maintenant = time.monotonic()
+        with self.verrou:
+            if maintenant - self.verifie_a < INTERVALLE_VERIFICATION:
+                return self.tableau, self.codes
+            self.verifie_a = maintenant
+            try:
+                etat = os.stat(self.chemin)
+            except FileNotFoundError:
+                self.tableau, self.codes, self.identite = None, None, None
+                return None, None
+            identite = (etat.st_ino, etat.st_mtime_ns, etat.st_size)
+            if identite != self.identite:
+                try:
+                    tableau = np.load(self.chemin, mmap_mode='r')
+                except (OSError, ValueError) as e:
+                    print("Snapshot partagé illisible :", e)
+                    return self.tableau, self.codes
+                self.tableau, self.codes, self.identite = tableau, tableau['code_insee'], identite
+            return self.tableau, self.codes
+
+    # Fonction pour connaître la date des relevés publiés (None si rien n'a encore été publié)
+    def date(self):
+        tableau, _ = self._tableau()
+        if tableau is None or not len(tableau):
+            return None
+        return tableau[0]['date'].decode('ascii')
+
+    # Fonction pour lire le relevé publié d'une commune (None si elle est absente)
+    def obtenir(self, code_commune_INSEE):
+        tableau, codes = self._tableau()
+        if tableau is None:
+            return None
+        cle = code_commune_INSEE.encode('ascii')
+        i = int(np.searchsorted(codes, cle))
+        if i < len(codes) and codes[i] == cle:
+            return vers_releve(tableau[i])
+        return None
+
+    # Fonction pour lire tous les relevés publiés (code INSEE -> relevé)
+    def releves(self):
+        tableau, _ = self._tableau()
+        if tableau is None:
+            return {}
+        return {ligne['code_insee'].decode('ascii'): vers_releve(ligne) for ligne in tableau}
+
+    # Verrou de fichier réservant le crawl à un seul worker ; renvoie False s'il est déjà pris
+    # (sans fcntl, sous Windows, chaque processus fait son propre crawl)
+    @contextmanager
+    def verrou_crawl(self):
+        if fcntl is None:
+            yield True
+            return
+        with open(self.chemin_verrou, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+# Moteur de snapshot régional des pollens
+# Parcourt toutes les communes de villes_hauts_de_france_modifie.csv en tâche de fond,
+# récupère une fois par jour la page pollen de chacune sur atmo-hdf.fr et garde le
+# résultat en mémoire, indexé par code_commune_INSEE. Les callbacks Dash n'ont plus
+# qu'à lire un dictionnaire au lieu d'interroger le site à chaque sélection.
+# Avec un stockage partagé (snapshot_partage.py), un seul worker fait le crawl du jour et le
+# publie ; les autres workers lisent les relevés publiés au lieu de garder leur propre copie.
+import datetime
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+
+import metriques
+import archive_http
+import client_http
+from archive_http import ReponseAbsente
+from cache_http import cache
+
+BASE_URL = "https://www.atmo-hdf.fr/air-commune/"
+
+# Réglages par défaut du crawl : 8 requêtes en parallèle et 10 requêtes par seconde
+# au maximum, soit environ 7 minutes pour les ~3 950 communes de la région
+CONCURRENCE = 8
+REQUETES_PAR_SECONDE = 10
+TENTATIVES = 4
+# Les récupérations à la volée (commune choisie avant le passage du crawl) ont leur propre débit,
+# en plus de celui du crawl : un utilisateur n'attend pas derrière les créneaux réservés par le crawl
+REQUETES_PAR_SECONDE_VOLEE = 2
+# Threads du worker réservés aux récupérations à la volée : les callbacks Dash ne les attendent jamais
+CONCURRENCE_VOLEE = 4
+# Durée pendant laquelle le résultat d'une récupération à la volée (relevé ou échec) est resservi
+# aux demandes suivantes, comptée depuis son lancement (plus longue qu'une récupération complète
+# avec ses reprises) : une commune en échec n'est pas redemandée à chaque interrogation du navigateur
+DUREE_RESULTAT_VOLEE = 120
+DELAI_BASE = 1.0
+# Intervalle de vérification du changement de jour par le thread de fond (en secondes)
+INTERVALLE_VERIFICATION = 300
+
+
+# Fonction pour construire l'URL de la page pollen d'une commune
+def construire_url(nom_commune, code_commune_INSEE, code_postal, date):
+    # Remplacer les espaces dans le nom de la commune par des tirets
+    nom_commune = nom_commune.replace(" ", "-")
+    return f"{BASE_URL}{nom_commune}/{code_commune_INSEE}/pollen?adresse={nom_commune}+({code_postal})&date={date}"
+
+
+# Fonction pour retrouver la date des données d'une page : celle demandée, sauf pour une page rejouée
+# depuis l'archive HTTP (rejeu ou secours), qui garde la date de son enregistrement. Le relevé n'entre
+# alors ni dans le snapshot du jour, ni dans sa publication, ni dans l'historique.
+def date_page(response, date):
+    if response.enregistree_a is None:
+        return date
+    dates = parse_qs(urlsplit(response.url_archivee or '').query).get('date')
+    if dates:
+        return dates[0]
+    return datetime.date.fromtimestamp(response.enregistree_a).isoformat()
+
+
+# Fonction pour connaître le jour du snapshot : aujourd'hui, sauf en rejeu de l'archive HTTP, où c'est le
+# jour de son enregistrement (les pages rejouées portent cette date, le snapshot d'aujourd'hui resterait vide)
+def jour_courant():
+    archive = client_http.client.archive
+    if archive is not None and archive.mode == archive_http.REJOUER:
+        jour = archive.jour_enregistrement()
+        if jour is not None:
+            return jour
+    return datetime.date.today().isoformat()
+
+
+# Relevé pollinique d'une commune pour une date
+# taxons : liste de (nom du taxon, catégorie de risque) ; indice : entier ou None ; couleur : code couleur atmo
+ReleveCommune = namedtuple('ReleveCommune', ['taxons', 'departement', 'indice', 'couleur', 'date'])
+
+CLASSE_TAXON = 'c-indice-pollen-taxon-title font-weight-bold text-center'
+CLASSE_CATEGORIE = 'text-uppercase mt-2'
+CLASSE_DEPARTEMENT = 'font-weight-bold text-uppercase mt-3'
+CLASSES_PARAGRAPHES = {CLASSE_TAXON, CLASSE_CATEGORIE, CLASSE_DEPARTEMENT}
+
+
+# Filtre appliqué pendant l'analyse : seuls les paragraphes utiles et le bloc de l'indice
+# global (avec son <span> de valeur et son <path> coloré) sont construits dans l'arbre
+def _balise_utile(nom, attributs):
+    classe = attributs.get('class') or ''
+    if not isinstance(classe, str):
+        classe = ' '.join(classe)
+    if nom == 'p':
+        return classe in CLASSES_PARAGRAPHES
+    if nom == 'div':
+        return 'c-indice-pollen' in classe.split()
+    return False
+
+
+FILTRE_PAGE = SoupStrainer(_balise_utile)
+
+
+# Fonction pour extraire en une seule analyse les taxons et leur catégorie de risque,
+# le niveau du département, l'indice global de la commune et sa couleur sur l'échelle atmo
+@metriques.chronometrer('analyse_page')
+def analyser_page(html_page, date=None):
+    soup = BeautifulSoup(html_page, 'html.parser', parse_only=FILTRE_PAGE)
+    balises_pollens = soup.find_all('p', class_=CLASSE_TAXON)
+    balises_categories = soup.find_all('p', class_=CLASSE_CATEGORIE)
+    balise_departement = soup.find('p', class_=CLASSE_DEPARTEMENT)
+
+    taxons = []
+    for pollen, categorie in zip(balises_pollens, balises_categories):
+        taxons.append((pollen.get_text(strip=True), categorie.get_text(strip=True)))
+
+    indice = None
+    couleur = None
+    pollen_value_span = soup.find('span', class_='pollen-value')
+    if pollen_value_span:
+        # La couleur de l'indice est portée par la balise <path> du bloc parent
+        parent_div = pollen_value_span.find_parent('div', class_='c-indice-pollen')
+        path_fill = parent_div.find('path') if parent_div else None
+        if path_fill and path_fill.has_attr('fill'):
+            couleur = path_fill['fill']
+        valeur = pollen_value_span.get_text(strip=True)
+        indice = int(valeur) if valeur.isdigit() else None
+
+    return ReleveCommune(
+        taxons=taxons,
+        departement=balise_departement.get_text(strip=True) if balise_departement else None,
+        indice=indice,
+        couleur=couleur,
+        date=date,
+    )
+
+
+# Limiteur de débit partagé par tous les threads du crawl
+# Chaque requête réserve le prochain créneau libre, espacé de 1 / requetes_par_seconde
+class LimiteurDebit:
+    def __init__(self, requetes_par_seconde):
+        self.intervalle = 1.0 / requetes_par_seconde
+        self.prochain_creneau = time.monotonic()
+        self.verrou = threading.Lock()
+
+    def attendre(self):
+        with self.verrou:
+            maintenant = time.monotonic()
+            creneau = max(self.prochain_creneau, maintenant)
+            self.prochain_creneau = creneau + self.intervalle
+        attente = creneau - maintenant
+        if attente > 0:
+            time.sleep(attente)
+
+
+class SnapshotPollen:
+    def __init__(self, data=None, concurrence=CONCURRENCE, requetes_par_seconde=REQUETES_PAR_SECONDE,
+                 tentatives=TENTATIVES, delai_base=DELAI_BASE, partage=None,
+                 requetes_par_seconde_volee=REQUETES_PAR_SECONDE_VOLEE):
+        if data is None:
+            data = pd.read_csv("villes_hauts_de_france_modifie.csv", dtype={'code_postal': str, 'code_commune_INSEE': str})
+        self.communes = data[['nom_commune_postal', 'code_commune_INSEE', 'code_postal']].drop_duplicates('code_commune_INSEE')
+        self.concurrence = concurrence
+        self.limiteur = LimiteurDebit(requetes_par_seconde)
+        self.limiteur_volee = LimiteurDebit(requetes_par_seconde_volee)
+        self.tentatives = tentatives
+        self.delai_base = delai_base
+        # Table en mémoire : code INSEE -> relevé du jour
+        # (avec un stockage partagé, seulement les relevés pas encore publiés)
+        self.table = {}
+        self.partage = partage
+        self.date_snapshot = None
+        self.verrou = threading.Lock()
+        self.verrou_crawl = threading.Lock()
+        self.metriques = {
+            'total': 0,
+            'termines': 0,
+            'echecs': 0,
+            'tentatives_supplementaires': 0,
+            'debut': None,
+            'fin': None,
+        }
+        self.thread = None
+        # Récupérations à la volée : code INSEE -> (Future partagé par les demandes simultanées, lancement)
+        self.en_cours = {}
+        self.executor_volee = ThreadPoolExecutor(max_workers=CONCURRENCE_VOLEE, thread_name_prefix='snapshot-volee')
+        # Fonctions appelées avec le snapshot à la fin de chaque rafraîchissement complet
+        self.abonnes = []
+
+    # Fonction pour récupérer et analyser la page d'une commune avec reprise sur erreur
+    # (limiteur : celui du crawl par défaut, celui des récupérations à la volée sinon)
+    # Les reprises sont faites ici seulement : le client HTTP ne fait qu'un essai par appel,
+    # et chaque essai passe par le limiteur de débit
+    def recuperer_commune(self, nom_commune, code_commune_INSEE, code_postal, date, limiteur=None):
+        limiteur = limiteur or self.limiteur
+        url = construire_url(nom_commune, code_commune_INSEE, code_postal, date)
+        for tentative in range(self.tentatives):
+            limiteur.attendre()
+            try:
+                response = cache.get(url, tentatives=1)
+                if response.status_code == 200:
+                    return analyser_page(response.text, date_page(response, date))
+                # Les erreurs client (hors 429) ne se corrigeront pas en réessayant
+                if response.status_code < 500 and response.status_code != 429:
+                    return None
+            except ReponseAbsente:
+                # Rejeu hors ligne : une page jamais enregistrée ne le sera pas davantage en réessayant
+                return None
+            except requests.RequestException:
+                pass
+            if tentative < self.tentatives - 1:
+                with self.verrou:
+                    self.metriques['tentatives_supplementaires'] += 1
+                # Attente exponentielle avec un peu d'aléa pour ne pas resynchroniser les threads
+                time.sleep(self.delai_base * (2 ** tentative) + random.uniform(0, self.delai_base))
+        return None
+
+    def _traiter(self, commune, date):
+        releve = self.recuperer_commune(commune.nom_commune_postal, commune.code_commune_INSEE, commune.code_postal, date)
+        with self.verrou:
+            if releve is not None:
+                self.table[commune.code_commune_INSEE] = releve
+                self.metriques['termines'] += 1
+            else:
+                self.metriques['echecs'] += 1
+        return releve
+
+    # Fonction pour parcourir toutes les communes de la région
+    def rafraichir(self, date=None):
+        if date is None:
+            date = jour_courant()
+        with self.verrou_crawl:
+            with self.verrou:
+                self.metriques.update({
+                    'total': len(self.communes),
+                    'termines': 0,
+                    'echecs': 0,
+                    'tentatives_supplementaires': 0,
+                    'debut': time.time(),
+                    'fin': None,
+                })
+            with ThreadPoolExecutor(max_workers=self.concurrence) as executor:
+                futures = [executor.submit(self._traiter, commune, date)
+                           for commune in self.communes.itertuples(index=False)]
+                for future in as_completed(futures):
+                    future.result()
+            with self.verrou:
+                self.date_snapshot = date
+                self.metriques['fin'] = time.time()
+            if self.partage is not None:
+                self._publier(date)
+        self._notifier()
+
+    # Fonction pour publier les relevés du jour dans le stockage partagé, qui remplace alors la table locale
+    def _publier(self, date):
+        with self.verrou:
+            releves = {code: releve for code, releve in self.table.items() if releve.date == date}
+        try:
+            self.partage.publier(releves)
+        except OSError as e:
+            print("Impossible de publier le snapshot partagé :", e)
+            return
+        with self.verrou:
+            self.table = {code: releve for code, releve in self.table.items() if code not in releves}
+
+    # Fonction pour reprendre les relevés du jour publiés par un autre worker
+    def _adopter(self, date):
+        with self.verrou:
+            self.date_snapshot = date
+            self.table = {code: releve for code, releve in self.table.items() if releve.date == date}
+        self._notifier()
+
+    # Fonction pour rafraîchir le snapshot, ou reprendre celui qu'un autre worker a déjà publié
+    def _rafraichir_ou_adopter(self, date):
+        if self.partage is None:
+            self.rafraichir(date)
+            return
+        if self.partage.date() == date:
+            self._adopter(date)
+            return
+        with self.partage.verrou_crawl() as obtenu:
+            if not obtenu:
+                # Un autre worker parcourt déjà la région : son résultat sera repris au prochain tour
+                return
+            if self.partage.date() == date:
+                self._adopter(date)
+            else:
+                self.rafraichir(date)
+
+    def _notifier(self):
+        for abonne in self.abonnes:
+            try:
+                abonne(self)
+            except Exception as e:
+                print("Échec d'un traitement après rafraîchissement du snapshot :", e)
+
+    # Fonction pour lire la date du snapshot et tous ses relevés (code INSEE -> relevé),
+    # y compris ceux publiés dans le stockage partagé
+    def releves(self):
+        partages = self.partage.releves() if self.partage is not None else {}
+        with self.verrou:
+            partages.update(self.table)
+            return self.date_snapshot, partages
+
+    # Fonction pour enregistrer un traitement à exécuter après chaque rafraîchissement (carte, exports...)
+    def abonner(self, fonction):
+        self.abonnes.append(fonction)
+
+    # Fonction pour obtenir l'avancement du crawl en cours (ou du dernier crawl)
+    def progression(self):
+        with self.verrou:
+            metriques = dict(self.metriques)
+        traites = metriques['termines'] + metriques['echecs']
+        debut, fin = metriques['debut'], metriques['fin']
+        duree = ((fin or time.time()) - debut) if debut else 0.0
+        metriques['traites'] = traites
+        metriques['pourcentage'] = 100.0 * traites / metriques['total'] if metriques['total'] else 0.0
+        metriques['duree'] = duree
+        metriques['communes_par_seconde'] = traites / duree if duree > 0 else 0.0
+        metriques['date_snapshot'] = self.date_snapshot
+        return metriques
+
+    # Fonction pour lire le relevé du jour d'une commune (None s'il n'est pas encore disponible)
+    def obtenir(self, code_commune_INSEE, date=None):
+        if date is None:
+            date = jour_courant()
+        releve = self.table.get(code_commune_INSEE)
+        if releve is None and self.partage is not None:
+            releve = self.partage.obtenir(code_commune_INSEE)
+        if releve is not None and releve.date == date:
+            return releve
+        return None
+
+    def _recuperer_volee(self, nom_commune, code_commune_INSEE, code_postal, date):
+        releve = self.recuperer_commune(nom_commune, code_commune_INSEE, code_postal, date,
+                                        limiteur=self.limiteur_volee)
+        if releve is not None:
+            with self.verrou:
+                self.table[code_commune_INSEE] = releve
+        return releve
+
+    # Fonction pour obtenir sans attendre le relevé d'une commune, sous forme de Future : déjà résolu si
+    # le relevé du jour est là, sinon la récupération est lancée dans un thread du worker (le callback
+    # renvoie alors un marqueur de chargement et le navigateur repasse plus tard)
+    # Les demandes simultanées pour une même commune partagent la même récupération
+    def recuperer_en_fond(self, nom_commune, code_commune_INSEE, code_postal):
+        date = jour_courant()
+        releve = self.obtenir(code_commune_INSEE, date)
+        if releve is not None:
+            future = Future()
+            future.set_result(releve)
+            return future
+        maintenant = time.monotonic()
+        with self.verrou:
+            entree = self.en_cours.get(code_commune_INSEE)
+            if entree is not None and (not entree[0].done() or maintenant - entree[1] < DUREE_RESULTAT_VOLEE):
+                return entree[0]
+            # Oubli des résultats trop anciens pour être resservis
+            self.en_cours = {code: (future, lancement) for code, (future, lancement) in self.en_cours.items()
+                             if not future.done() or maintenant - lancement < DUREE_RESULTAT_VOLEE}
+            future = self.executor_volee.submit(self._recuperer_volee, nom_commune, code_commune_INSEE, code_postal, date)
+            self.en_cours[code_commune_INSEE] = (future, maintenant)
+        return future
+
+    def _boucle(self):
+        while True:
+            date = jour_courant()
+            if self.date_snapshot != date:
+                try:
+                    self._rafraichir_ou_adopter(date)
+                except Exception as e:
+                    print("Échec du rafraîchissement du snapshot pollen :", e)
+            time.sleep(INTERVALLE_VERIFICATION)
+
+    # Fonction pour lancer le rafraîchissement quotidien en tâche de fond
+    def demarrer(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._boucle, name='snapshot-pollen', daemon=True)
+            self.thread.start()
+        return self
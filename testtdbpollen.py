@@ -2,67 +2,43 @@
 
 # Import des bibliothèques et des modules
 import dash
-from dash import html, dcc, Input, Output
+from dash import html, dcc, Input, Output, State
+from dash.exceptions import PreventUpdate
 import requests
 from bs4 import BeautifulSoup
-import pandas as pd
-import base64
 from io import BytesIO
-from io import StringIO
 import folium
+import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
-import functools
-
-# Fonction pour récupérer et encoder une image depuis une URL
-def fetch_and_encode_image(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        return 'data:image/jpg;base64,' + base64.b64encode(response.content).decode('ascii')
-    else:
-        return None
-
-# Fonction de création de la carte
-def create_map():
-    # Coordonnées du centre des Hauts-de-France
-    center_lat, center_lon = 49.894483, 2.985636
-    # Créer une carte centrée sur les Hauts-de-France
-    m = folium.Map(location=[center_lat, center_lon], zoom_start=7.5)
-    # URL du fichier GeoJSON
-    geojson_url = "https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/regions/hauts-de-france/departements-hauts-de-france.geojson"
-    # Télécharger les données GeoJSON
-    response = requests.get(geojson_url)
-    if response.status_code == 200:
-        geojson_data = response.json()
-        # Ajouter la superposition GeoJSON
-        folium.GeoJson(
-            geojson_data,
-            name='geojson',
-            style_function=lambda x: {'fillOpacity': 0, 'color': 'black', 'weight': 2}
-        ).add_to(m)
-    else:
-        print("Failed to download GeoJSON data")
-    # Enregistrer la carte sous forme de fichier HTML
-    m.save('hauts_de_france_map.html')
-
-# Fonction pour convertir le niveau de risque en couleur
-def risk_to_color(risk_level):
-    colors = {
-        'Nul': '#ADD8E6',
-        'Faible': 'green',
-        'Moyen': 'yellow',
-        'Élevé': 'red'
-    }
-    return colors.get(risk_level, 'gray')
+import datetime
+import demarrage
+import metriques
+import export_pollens
+import client_http
+from snapshot_pollen import SnapshotPollen
+from snapshot_partage import SnapshotPartage
+from cache_http import cache
+from index_communes import IndexCommunes
+from proximite_communes import ProximiteCommunes
+import carte_pollen
+from carte_pollen import CartePollen, CacheRendus
+from fragments_pollen import FragmentsPollen
+import contours_communes
+from historique_pollen import HistoriquePollen
+from article_surveillance import ArticleSurveillance
+import images_statiques
+from images_statiques import composant_image
 
 # Fonction pour aller chercher les recommandation sur le site atmo France
-@functools.lru_cache(maxsize=None)
+# (la page passe par le cache HTTP partagé, rafraîchi une fois par jour)
 def fetch_pollen_recommendations():
     url = 'https://www.atmo-france.org/article/lindice-pollinique'
     try:
-        response = requests.get(url)
+        response = cache.get(url)
         response.raise_for_status()  # Ensure the request was successful
 
-        soup = BeautifulSoup(response.text, 'html.parser')
+        with metriques.mesurer('analyse_html', page='recommandations'):
+            soup = BeautifulSoup(response.text, 'html.parser')
         content_section = soup.find('h2', id='item-4755')
 
         if content_section:
@@ -79,24 +55,73 @@ def fetch_pollen_recommendations():
 # Initialisation de l'application Dash avec le thème Bootstrap
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
-# Import et Lecture des données CSV pour les données de la ville
-url_ville = "https://drive.google.com/uc?export=download&id=1B0it1rkyEXHtbqesq5_NP4pHFuSiLoY4"
-response = requests.get(url_ville)
-response.raise_for_status()  # This will raise an exception if the download failed
+# Lecture de la table des communes depuis le fichier local (ou son cache binaire)
+data = demarrage.charger_communes()
+
+# Création de la carte de base, une seule fois au démarrage
+carte_base = demarrage.carte_base()
+# Cartes zoomées déjà produites, indexées par (code INSEE, date des données, contour disponible)
+cache_cartes = CacheRendus()
 
-data = pd.read_csv(StringIO(response.text), dtype={'code_postal': str, 'code_commune_INSEE': str})
+# Index des communes (nom normalisé, code INSEE) construit une seule fois au démarrage
+index = IndexCommunes(data)
+# Nombre maximum de communes proposées par l'autocomplétion
+NOMBRE_SUGGESTIONS = 20
+# Index spatial des communes pour retrouver la plus proche de la position du navigateur
+proximite = ProximiteCommunes(data)
+# Nombre de communes voisines proposées et distance maximale à la plus proche (au-delà : hors région)
+NOMBRE_VOISINES = 5
+DISTANCE_MAX_KM = 15
 
-#data = pd.read_csv("villes_hauts_de_france_modifie.csv", dtype={'code_postal': str, 'code_commune_INSEE': str})
+# Téléchargement des images statiques dans assets/ en tâche de fond
+images_statiques.demarrer(app)
 
-# Appliquer une fonction pour ajuster les noms de communes
-def ajuster_nom_commune(nom_commune):
-    return nom_commune.replace(" ", "-")
+# Lancement du snapshot régional des pollens en tâche de fond
+# La carte régionale est régénérée à la fin de chaque rafraîchissement du snapshot
+# Les relevés du jour sont publiés dans un fichier projeté en mémoire par tous les workers :
+# un seul worker fait le crawl, les autres reprennent son résultat (gunicorn sans --preload, pour
+# que chaque worker démarre ses propres threads de fond)
+snapshot = SnapshotPollen(data, partage=SnapshotPartage())
+# Pendant la récupération d'une commune pas encore crawlée, le navigateur repasse toutes les secondes
+INTERVALLE_ATTENTE_COMMUNE = 1000
+# La carte de base est servie tant que le premier crawl n'est pas terminé
+carte = CartePollen(secours=carte_base)
+snapshot.abonner(carte.rafraichir)
+# Les tableaux des communes sont produits à l'avance à chaque rafraîchissement
+fragments = FragmentsPollen()
+snapshot.abonner(fragments.rafraichir)
+# Chaque journée crawlée est ajoutée à l'historique local
+historique = HistoriquePollen()
+snapshot.abonner(historique.enregistrer_snapshot)
+snapshot.demarrer()
 
-# Appliquer la fonction à la colonne 'nom_commune_postal'
-data['nom_commune_postal'] = data['nom_commune_postal'].apply(ajuster_nom_commune)
+# Article « Surveillance des pollens » relu une fois par heure pour tous les navigateurs
+article = ArticleSurveillance().demarrer()
+# Les navigateurs comparent la version qu'ils affichent à celle du serveur une fois par heure, au
+# rythme du rafraîchissement de l'article : pas plus de requêtes qu'avant, seulement plus légères
+INTERVALLE_VERSION_ARTICLE = 3600000
 
-# Création de la carte
-create_map()
+# Rafraîchissement des copies distantes (CSV des communes, contours) en tâche de fond
+demarrage.rafraichir_en_fond()
+
+# Mesures des étapes coûteuses et statistiques des caches, servies sur la route /metrics
+metriques.exposer(app)
+metriques.suivre('pollen_cache_http_total', "Lectures du cache HTTP partagé", lambda: cache.statistiques)
+metriques.suivre('pollen_client_http_total', "Requêtes du client HTTP partagé", lambda: client_http.client.statistiques)
+metriques.suivre('pollen_disjoncteur_echecs', "Échecs consécutifs par hôte", client_http.client.etat,
+                 etiquette='hote', type_metrique='gauge')
+metriques.suivre('pollen_cache_cartes_total', "Lectures du cache des cartes zoomées", lambda: cache_cartes.statistiques)
+metriques.suivre('pollen_fragments_total', "Lectures des tableaux produits à l'avance", lambda: fragments.statistiques)
+metriques.suivre('pollen_fragments', "Taille des tableaux produits à l'avance", fragments.taille,
+                 etiquette='mesure', type_metrique='gauge')
+metriques.suivre('pollen_snapshot', "Avancement du crawl régional", snapshot.progression,
+                 etiquette='mesure', type_metrique='gauge')
+
+# Export en masse du snapshot du jour (CSV, NDJSON ou Parquet) sur /export/pollens.<format>
+export_pollens.exposer(app, snapshot, index)
+
+# Carte régionale servie sur /carte/region.html : l'iframe ne reçoit que son adresse, qui change avec la carte
+carte_pollen.exposer(app, carte)
 
 # Mise en place des différentes parties du tableau de bord
 app.layout = html.Div([
@@ -118,6 +143,7 @@ app.layout = html.Div([
             dcc.Tabs(id='tabs', value='tab-1', children=[
                 dcc.Tab(label='Accueil', value='tab-1'),
                 dcc.Tab(label="L'air de ma commune", value='tab-2'),
+                dcc.Tab(label='Historique', value='tab-6'),
                 dcc.Tab(label='Recommandations', value='tab-3'),
                 dcc.Tab(label='Informations sur le Pollen', value='tab-5'),
                 dcc.Tab(label='La mesure des pollens', value='tab-4')
@@ -134,6 +160,7 @@ app.layout = html.Div([
     Output('tabs-content', 'children'),
     Input('tabs', 'value')
 )
+@metriques.chronometrer('render_content')
 def render_content(tab):
     if tab == 'tab-1':
         return html.Div([
@@ -141,27 +168,17 @@ def render_content(tab):
             html.P("Explorez les différents onglets pour obtenir des informations sur les pollens dans votre région.")
         ])
     elif tab == 'tab-5':
-        image_url = "https://www.atmo-hdf.fr/sites/hdf/files/styles/large_w1500/public/medias/images/2023-08/Calendrier_pollens_Hauts-de-France.jpg"
-        encoded_image = fetch_and_encode_image(image_url)
-        if encoded_image:
-            image_html = html.Img(src=encoded_image, style={'width': '100%', 'height': 'auto'})
-        else:
-            image_html = "Image du calendrier non disponible"
-
+        # Les images sont servies depuis le dossier assets/ : seule leur URL est envoyée
         return html.Div([
             html.H1("Info générale sur les pollens"),
             html.Div(id='pollen-info'),
-            dcc.Interval(id='interval-component', interval=3600000, n_intervals=0),
+            dcc.Interval(id='interval-component', interval=INTERVALLE_VERSION_ARTICLE, n_intervals=0),
+            dcc.Store(id='version-article'),
             html.H4("Pour les Hauts-de-France, on observe le calendrier :"),
-            html.Img(src=encoded_image, style={'width': '80%', 'height': 'auto'}) if encoded_image else "Image non disponible"
+            composant_image('calendrier_pollens', {'width': '80%', 'height': 'auto'})
         ])
     elif tab == 'tab-2':
-        image_url = "https://www.atmo-hdf.fr/sites/hdf/files/medias/images/2022-03/echelle_pollens_2022.jpg"
-        encoded_image = fetch_and_encode_image(image_url)
-        if encoded_image:
-            image_html = html.Img(src=encoded_image, style={'width': '100%', 'height': 'auto'})
-        else:
-            image_html = "Image de l'échelle des pollens non disponible"
+        image_html = composant_image('echelle_pollens', {'width': '100%', 'height': 'auto'})
 
         return [
             html.Div([
@@ -172,30 +189,71 @@ def render_content(tab):
                     html.Div([
                         html.H1(" "),
                         html.Label("Recherchez une commune : "),
-                        # Menu de choix déroulant avec autocomplétion (liste: data["nom_commune_postal"])
+                        # Menu de choix déroulant avec autocomplétion côté serveur (valeur: code INSEE)
+                        # Les options sont envoyées au fur et à mesure de la saisie par update_options
                         dcc.Dropdown(
                             id="input-ville",
-                            options=[{'label': i, 'value': i} for i in data["nom_commune_postal"].unique()],
+                            options=[],
                             value="",
                             placeholder="Entrez une commune"
                         ),
-                        html.Div(id="output-container"),
+                        # Recherche de la commune la plus proche de la position du téléphone ou de l'ordinateur
+                        html.Button("Me localiser", id="bouton-position", n_clicks=0, className="btn btn-outline-success btn-sm mt-2"),
+                        dcc.Store(id="position-navigateur"),
+                        html.Div(id="message-position"),
+                        # Données de la commune choisie, partagées par le tableau et la carte,
+                        # avec un indicateur de chargement pendant leur récupération ; l'intervalle
+                        # n'est actif que pendant la récupération d'une commune pas encore crawlée
+                        dcc.Interval(id="attente-commune", interval=INTERVALLE_ATTENTE_COMMUNE, disabled=True),
+                        dcc.Loading([
+                            dcc.Store(id="donnees-commune"),
+                            html.Div(id="output-container")
+                        ], type='circle'),
                         html.H1(" "),
                         image_html,
                     ]),
                 ], width=4),
                 dbc.Col([
                     html.H1(" "),
-                    html.Div(id="map-container", children=[
+                    dcc.Loading(html.Div(id="map-container", children=[
                         html.Iframe(
                             id="map-iframe",
-                            srcDoc=open('hauts_de_france_map.html', 'r').read(),
+                            src=carte.url(),
                             width='95%',
                             height='450'
-                        )]),
+                        )]), type='circle'),
                 ], width=8)
             ])
         ]
+    elif tab == 'tab-6':
+        with metriques.mesurer('lecture_historique'):
+            debut, fin = historique.bornes()
+        aujourd_hui = datetime.date.today().isoformat()
+        return html.Div([
+            html.H1("Évolution du risque pollinique par commune"),
+            dbc.Row([
+                dbc.Col([
+                    html.Label("Recherchez une commune : "),
+                    dcc.Dropdown(id="input-ville-historique", options=[], value="", placeholder="Entrez une commune"),
+                ], width=4),
+                dbc.Col([
+                    html.Label("Pollens : "),
+                    dcc.Dropdown(id="taxons-historique", options=[], value=[], multi=True, placeholder="Tous les pollens"),
+                ], width=4),
+                dbc.Col([
+                    html.Label("Période : "),
+                    dcc.DatePickerRange(
+                        id="dates-historique",
+                        min_date_allowed=debut,
+                        max_date_allowed=fin or aujourd_hui,
+                        start_date=debut,
+                        end_date=fin or aujourd_hui,
+                        display_format='DD/MM/YYYY'
+                    ),
+                ], width=4),
+            ]),
+            dcc.Graph(id="graphique-historique")
+        ])
     elif tab == 'tab-3':
         recommendations = fetch_pollen_recommendations()
         return html.Div([
@@ -203,155 +261,277 @@ def render_content(tab):
             html.Ul([html.Li(item) for item in recommendations])
         ])
     elif tab == 'tab-4':
-        image_url = "https://www.atmo-hdf.fr/sites/hdf/files/medias/images/2022-09/capteur_pollens_info.jpg"
-        encoded_image = fetch_and_encode_image(image_url)
-        if encoded_image:
-            image_html = html.Img(src=encoded_image, style={'width': '40%', 'height': 'auto'})
-        else:
-            image_html = "Image de l'échelle des pollens non disponible"
-
-        url = "https://www.atmo-hdf.fr/article/surveillance-des-pollens"
-        response = requests.get(url)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, "html.parser")
-            iframe_tag = soup.find("iframe", src=True)  # Updated to find any iframe with a src attribute
-            if iframe_tag:
-                video_url = iframe_tag["src"]
-                return html.Div([
-                    html.H1("Comment ça marche la mesure des pollens?"),
-                    image_html,
-                    html.H1(" "),
-                    html.Iframe(src=video_url, width="840", height="472", style={'border': 'none'})
-                ])
-            else:
-                return html.Div("La balise iframe spécifiée n'a pas été trouvée sur la page.")
+        image_html = composant_image('capteur_pollens', {'width': '40%', 'height': 'auto'})
+
+        # Adresse de la vidéo lue par le rafraîchissement partagé de l'article
+        version, paragraphes, video_url, erreur = article.obtenir()
+        if erreur is not None:
+            return html.Div(erreur)
+        if video_url:
+            return html.Div([
+                html.H1("Comment ça marche la mesure des pollens?"),
+                image_html,
+                html.H1(" "),
+                html.Iframe(src=video_url, width="840", height="472", style={'border': 'none'})
+            ])
         else:
-            return html.Div(f"La requête a échoué avec le code de statut: {response.status_code}")
+            return html.Div("La balise iframe spécifiée n'a pas été trouvée sur la page.")
 
 # Callback pour mettre à jour les informations sur les pollens
+# L'article est lu et analysé par un seul rafraîchissement côté serveur : le navigateur envoie
+# la version qu'il affiche et ne reçoit les paragraphes que si l'article a changé
 @app.callback(
     Output('pollen-info', 'children'),
-    Input('interval-component', 'n_intervals')
+    Output('version-article', 'data'),
+    Input('interval-component', 'n_intervals'),
+    State('version-article', 'data')
 )
-def update_pollen_info(n):
-    url = "https://www.atmo-hdf.fr/article/surveillance-des-pollens"
-    response = requests.get(url)
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.text, "html.parser")
-        div_field_item = soup.find("div", class_="field__item")
-        paragraphs = div_field_item.find_all("p")
-        return html.Ul([html.Li(p.text) for p in paragraphs])
+def update_pollen_info(n, version_affichee):
+    version, paragraphes, video_url, erreur = article.obtenir()
+    if erreur is not None:
+        return erreur, None
+    if version == version_affichee:
+        raise PreventUpdate
+    return html.Ul([html.Li(p) for p in paragraphes]), version
+
+# Fonction d'autocomplétion : seules les premières communes correspondant à la saisie sont envoyées au navigateur
+def options_autocompletion(search_value, value):
+    if not search_value:
+        raise PreventUpdate
+    # La clé 'search' empêche le filtrage côté navigateur d'écarter les résultats approchés
+    # (saisie "saint omer" pour le libellé "ST-OMER" par exemple)
+    options = [dict(option, search=search_value) for option in index.options_pour(search_value, limite=NOMBRE_SUGGESTIONS)]
+    # Garder la commune déjà sélectionnée dans la liste pour que son libellé reste affiché
+    option_courante = index.option_par_insee.get(value)
+    if option_courante is not None and all(option['value'] != value for option in options):
+        options = [option_courante] + options
+    return options
+
+# Callback d'autocomplétion du menu de l'onglet commune
+@app.callback(
+    Output("input-ville", "options"),
+    Input("input-ville", "search_value"),
+    State("input-ville", "value")
+)
+def update_options(search_value, value):
+    return options_autocompletion(search_value, value)
+
+# Demande de la position au navigateur (exécutée côté client : le serveur ne reçoit que les coordonnées)
+app.clientside_callback(
+    """
+    function(n_clicks) {
+        if (!n_clicks) {
+            return window.dash_clientside.no_update;
+        }
+        return new Promise(function(resolve) {
+            if (!navigator.geolocation) {
+                resolve({erreur: "La géolocalisation n'est pas disponible dans ce navigateur."});
+                return;
+            }
+            navigator.geolocation.getCurrentPosition(
+                function(position) {
+                    resolve({latitude: position.coords.latitude, longitude: position.coords.longitude});
+                },
+                function(erreur) {
+                    resolve({erreur: "Position indisponible : " + erreur.message});
+                },
+                {timeout: 10000, maximumAge: 600000}
+            );
+        });
+    }
+    """,
+    Output("position-navigateur", "data"),
+    Input("bouton-position", "n_clicks")
+)
+
+# Callback pour sélectionner la commune la plus proche de la position reçue du navigateur
+# (les communes voisines restent proposées dans le menu déroulant)
+@app.callback(
+    Output("input-ville", "value"),
+    Output("input-ville", "options", allow_duplicate=True),
+    Output("message-position", "children"),
+    Input("position-navigateur", "data"),
+    prevent_initial_call=True
+)
+def localiser_commune(position):
+    if not position:
+        raise PreventUpdate
+    if 'erreur' in position:
+        return dash.no_update, dash.no_update, position['erreur']
+    with metriques.mesurer('commune_proche'):
+        voisines = proximite.plus_proches(position['latitude'], position['longitude'], k=NOMBRE_VOISINES)
+    code, distance = voisines[0]
+    if distance > DISTANCE_MAX_KM:
+        return dash.no_update, dash.no_update, "Votre position est en dehors des Hauts-de-France."
+    options = [index.option_par_insee[code_voisine] for code_voisine, _ in voisines]
+    return code, options, f"Commune la plus proche : {index.par_insee[code].nom} ({distance:.1f} km)"
+
+# Callback d'autocomplétion du menu de l'onglet historique
+@app.callback(
+    Output("input-ville-historique", "options"),
+    Input("input-ville-historique", "search_value"),
+    State("input-ville-historique", "value")
+)
+def update_options_historique(search_value, value):
+    return options_autocompletion(search_value, value)
+
+# Callback pour proposer les pollens relevés dans la commune choisie
+@app.callback(
+    Output("taxons-historique", "options"),
+    Input("input-ville-historique", "value")
+)
+def update_taxons_historique(ville):
+    if not ville:
+        return []
+    return [{'label': taxon, 'value': taxon} for taxon in historique.taxons(ville)]
+
+# Callback pour tracer l'évolution des pollens d'une commune sur la période choisie
+@app.callback(
+    Output("graphique-historique", "figure"),
+    Input("input-ville-historique", "value"),
+    Input("taxons-historique", "value"),
+    Input("dates-historique", "start_date"),
+    Input("dates-historique", "end_date")
+)
+def update_historique(ville, taxons, debut, fin):
+    figure = go.Figure()
+    figure.update_layout(
+        yaxis={'tickvals': [0, 1, 2, 3], 'ticktext': ['Nul', 'Faible', 'Moyen', 'Élevé'], 'range': [-0.2, 3.2]},
+        xaxis={'title': 'Date'},
+        legend={'title': 'Pollen'}
+    )
+    if not ville or not debut or not fin:
+        return figure
+    series = {}
+    for date, taxon, categorie, niveau in historique.serie_taxons(ville, debut[:10], fin[:10], taxons):
+        dates, niveaux = series.setdefault(taxon, ([], []))
+        dates.append(date)
+        niveaux.append(niveau)
+    for taxon, (dates, niveaux) in series.items():
+        figure.add_trace(go.Scatter(x=dates, y=niveaux, mode='lines+markers', name=taxon))
+    return figure
+
+# Callback unique de récupération des données d'une commune : le relevé est lu une seule fois
+# et rangé dans le dcc.Store 'donnees-commune', d'où le tableau et la carte sont produits
+# Le callback ne fait jamais attendre le worker : une commune pas encore crawlée est récupérée dans
+# un thread du snapshot (les demandes simultanées partagent la même récupération), le Store reçoit
+# un marqueur de chargement et l'intervalle 'attente-commune' rappelle le callback jusqu'au résultat
+@app.callback(
+    Output("donnees-commune", "data"),
+    Output("attente-commune", "disabled"),
+    Input("input-ville", "value"),
+    Input("attente-commune", "n_intervals"),
+    State("donnees-commune", "data")
+)
+def charger_commune(ville, n_intervals, donnees=None):
+    if not ville:
+        return None, True
+    with metriques.mesurer('recherche_commune'):
+        communes = index.resoudre(ville)
+    if len(communes) == 1:
+        commune = communes[0]
+        # Lecture du relevé dans le snapshot (récupéré à la volée si le crawl n'y est pas encore passé)
+        with metriques.mesurer('releve_commune'):
+            future = snapshot.recuperer_en_fond(commune.nom, commune.code_insee, commune.code_postal)
+        if not future.done():
+            chargement = {'code_insee': commune.code_insee, 'releve': None, 'chargement': True,
+                          'message': "Récupération des données pollen de cette commune…"}
+            # Récupération toujours en cours : un Store qui porte déjà ce marqueur n'est pas réécrit,
+            # pour ne pas redéclencher le tableau et la carte à chaque interrogation
+            if donnees == chargement:
+                return dash.no_update, False
+            return chargement, False
+        releve = future.result()
+        if releve is None:
+            return {'code_insee': commune.code_insee, 'releve': None,
+                    'message': "Les données pollen de cette commune sont indisponibles pour le moment."}, True
+        return {'code_insee': commune.code_insee, 'releve': releve._asdict()}, True
+    elif len(communes) > 1:
+        # Même nom dans plusieurs départements : on demande de préciser
+        return {'message': "Plusieurs communes portent ce nom : {}.".format(
+            ", ".join(f"{c.nom} ({c.departement}, {c.code_postal})" for c in communes))}, True
     else:
-        return "La requête a échoué avec le code de statut: {}".format(response.status_code)
+        suggestions = index.suggerer(ville)
+        if suggestions:
+            return {'message': "Ville non trouvée. Vouliez-vous dire : {} ?".format(", ".join(c.nom for c in suggestions))}, True
+        return {'message': "Ville non trouvée."}, True
 
-# Callback pour les données sur les pollens par ville
+# Callback pour le tableau des pollens de la commune, produit à partir des données déjà récupérées
 @app.callback(
     Output("output-container", "children"),
-    Input("input-ville", "value")
+    Input("donnees-commune", "data")
 )
-def update_output(ville):
-    if ville:
-        ville_clean = ville.replace(" ", "")
-        row = data[data['nom_commune_postal'].str.lower() == ville_clean.lower()]
-        if not row.empty:
-            url = f"https://www.atmo-hdf.fr/air-commune/{ville_clean}/{row.iloc[0]['code_commune_INSEE']}/pollen?adresse={ville}+({row.iloc[0]['code_postal']})&date=2024-04-19"
-            response = requests.get(url)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                balises_pollens = soup.find_all('p', class_='c-indice-pollen-taxon-title font-weight-bold text-center')
-                balises_categories = soup.find_all('p', class_='text-uppercase mt-2')
-
-                associations = []
-                for pollen, categorie in zip(balises_pollens, balises_categories):
-                    nom_pollen = pollen.get_text(strip=True)
-                    nom_categorie = categorie.get_text(strip=True)
-                    color = risk_to_color(nom_categorie)
-                    color_circle = html.Span(style={'height': '20px', 'width': '20px', 'backgroundColor': color, 'borderRadius': '50%', 'display': 'inline-block', 'marginRight': '10px', 'marginLeft': '40px'})
-                    associations.append((nom_pollen, color_circle, nom_categorie))
-
-                output_rows = []
-                for assoc in associations:
-                    output_rows.append(html.Tr([html.Td(assoc[0]), html.Td([assoc[1], assoc[2]])]))
-                    output_rows.append(html.Tr([html.Td('', style={'height': '10px'})]))  # Ligne vide avec hauteur
-
-                output = html.Table([
-                    html.Thead(html.Tr([html.Th("Pollen"), html.Th("Risque")])),
-                    html.Tbody(output_rows)
-                ])
-                return output
-            else:
-                return "La requête a échoué avec le code : {}".format(response.status_code)
-        else:
-            return "Ville non trouvée."
-
-def color_ville(ville):
-    if ville:
-        ville_clean = ville.replace(" ", "")
-        row = data[data['nom_commune_postal'].str.lower() == ville_clean.lower()]
-        if not row.empty:
-            url = f"https://www.atmo-hdf.fr/air-commune/{ville_clean}/{row.iloc[0]['code_commune_INSEE']}/pollen?adresse={ville}+({row.iloc[0]['code_postal']})&date=2024-04-19"
-            response = requests.get(url)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                pollen_value_span = soup.find('span', class_='pollen-value')
-                max_pollen_color = None
-                if pollen_value_span:
-                    # Trouver la balise parente contenant la couleur
-                    parent_div = pollen_value_span.find_parent('div', class_='c-indice-pollen')
-                    if parent_div:
-                        # Trouver la balise <path> dans le parent div
-                        path_fill = parent_div.find('path')
-                        if path_fill:
-                            couleur_fill = path_fill['fill']
-                            valeur_pollen = int(pollen_value_span.get_text(strip=True))
-                            return couleur_fill
-    return None
-
-# Fonction pour mettre à jour la carte
-def update_map(ville):
-    if ville:
-        ville_clean = ville.replace(" ", "")
-        row = data[data['nom_commune_postal'].str.lower() == ville_clean.lower()]
-        if not row.empty:
-            center_lat = row.iloc[0]['latitude']
-            center_lon = row.iloc[0]['longitude']
-            m = folium.Map(location=[center_lat, center_lon], zoom_start=12)
-
-            # Ajouter les contours de la ville avec la couleur basée sur le risque de pollen
-            ville_geojson_url = f"https://nominatim.openstreetmap.org/search.php?q={ville_clean}&polygon_geojson=1&format=json"
-            response = requests.get(ville_geojson_url)
-            if response.status_code == 200:
-                ville_geojson = response.json()
-                if len(ville_geojson) > 0:
-                    folium.GeoJson(
-                        ville_geojson[0]['geojson'],
-                        name='Ville',
-                        style_function=lambda feature: {
-                            'fillColor': color_ville(ville),
-                            'color': color_ville(ville),
-                            'weight': 2,
-                            'fillOpacity': 0.7,
-                        }
-                    ).add_to(m)
-                else:
-                    print("No GeoJSON data found for the city")
-            else:
-                print("Failed to download city GeoJSON data")
+@metriques.chronometrer('update_output')
+def update_output(donnees):
+    if not donnees:
+        return None
+    releve = donnees.get('releve')
+    if releve is None:
+        return donnees['message']
+    # Tableau déjà produit (et converti en JSON) après le rafraîchissement du snapshot
+    return fragments.obtenir(donnees['code_insee'], releve)
 
-            m.save('zoomed_map.html')
-            return open('zoomed_map.html', 'r').read()
-        else:
-            return open('hauts_de_france_map.html', 'r').read()
+# Niveau de zoom des cartes centrées sur une commune
+ZOOM_COMMUNE = 12
+
+# Fonction pour produire la carte zoomée sur une commune, colorée selon son indice pollinique
+def generer_carte_commune(commune, couleur):
+    m = folium.Map(location=[commune.latitude, commune.longitude], zoom_start=ZOOM_COMMUNE)
+
+    # Ajouter les contours de la ville (lus dans le magasin local) avec la couleur basée sur le risque de pollen
+    # Tant que le magasin n'est pas chargé (en tâche de fond), la carte est tracée sans contour
+    magasin = contours_communes.contours()
+    contour = None
+    if magasin is not None:
+        with metriques.mesurer('contour_commune'):
+            contour = magasin.contour(commune.code_insee, zoom=ZOOM_COMMUNE)
+    if contour is not None:
+        folium.GeoJson(
+            contour,
+            name='Ville',
+            style_function=lambda feature: {
+                'fillColor': couleur,
+                'color': couleur,
+                'weight': 2,
+                'fillOpacity': 0.7,
+            }
+        ).add_to(m)
     else:
-        return open('hauts_de_france_map.html', 'r').read()
+        print("No GeoJSON data found for the city")
 
-# Callback pour mettre à jour la source de la carte lorsque la sélection de la ville change
+    with metriques.mesurer('rendu_folium'):
+        return m.get_root().render()
+
+# Fonction pour produire la carte de la commune choisie (None sans commune : carte régionale)
+@metriques.chronometrer('update_map')
+def update_map(donnees):
+    if not donnees or 'code_insee' not in donnees:
+        return None
+    commune = index.par_insee[donnees['code_insee']]
+    releve = donnees['releve']
+    if releve is None:
+        return generer_carte_commune(commune, None)
+    # Une carte tracée sans contour n'est pas resservie une fois les contours chargés
+    return cache_cartes.obtenir_ou_generer(
+        (commune.code_insee, releve['date'], contours_communes.contours() is not None),
+        lambda: generer_carte_commune(commune, releve['couleur']))
+
+# Callback pour mettre à jour la source de la carte lorsque les données de la commune changent
+# La carte d'une commune est envoyée dans srcDoc ; sans commune, srcDoc est retiré et l'iframe
+# recharge la carte régionale depuis son adresse (souvent déjà dans le cache du navigateur)
 @app.callback(
+    Output('map-iframe', 'src'),
     Output('map-iframe', 'srcDoc'),
-    Input('input-ville', 'value')
+    Input('donnees-commune', 'data')
 )
-def update_map_src(ville):
-    return update_map(ville)
+def update_map_src(donnees):
+    html_carte = update_map(donnees)
+    if html_carte is None:
+        return carte.url(), None
+    return dash.no_update, html_carte
+
+# Affichage de la durée du démarrage à froid
+demarrage.rapport()
 
 if __name__ == '__main__':
-    app.run_server(debug=False)
\ No newline at end of file
+    app.run_server(debug=False)